@@ -2,25 +2,57 @@ from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 from authlib.integrations.flask_client import OAuth
-from flask_sqlalchemy import SQLAlchemy
 
 from flask_bootstrap import Bootstrap
 
 from config import Config
+from app.jwks import JWKSCache
+from app.tokens import VerifiedTokenCache
+from app.cache import ResponseCache
+from app.jobs import JobQueue
+from app.storage import Storage
+from app.urls import PhotoUrls
+from app.streaming import StreamingRequest
+from app.dbstats import QueryStats
+from app.metrics import Metrics, instrument_boto3
+from app.sessions import ServerSideSessions
+from app.replicas import RoutingSQLAlchemy, ReplicaRouter
 
 bootstrap = Bootstrap()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+replicas = ReplicaRouter(db)
 migrate = Migrate()
 oauth = OAuth()
+jwks_cache = JWKSCache()
+token_cache = VerifiedTokenCache()
+response_cache = ResponseCache()
+jobs = JobQueue()
+storage = Storage()
+photo_urls = PhotoUrls(storage)
+query_stats = QueryStats()
+metrics = Metrics()
+server_sessions = ServerSideSessions()
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.request_class = StreamingRequest
+    query_stats.init_app(app)
+    metrics.init_app(app)
+    server_sessions.init_app(app)
     db.init_app(app)
+    replicas.init_app(app)
     migrate.init_app(app, db)
     bootstrap.init_app(app)
     oauth.init_app(app)
+    jwks_cache.init_app(app)
+    token_cache.init_app(app)
+    response_cache.init_app(app)
+    storage.init_app(app)
+    instrument_boto3(getattr(storage.backend, "client", None))
+    photo_urls.init_app(app)
+    jobs.init_app(app)
 
     app.auth0 = oauth.register(
         "auth0",
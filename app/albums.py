@@ -0,0 +1,189 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import aliased
+
+from app import db, jobs, storage, response_cache
+from app.blobs import release_images
+from app.models import Album, Image, DailyPick
+from app.slugs import encode_slug, decode_slug
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def new_album(name, user_id):
+    """Insert an album whose url is the slug of its id, and commit it."""
+    album = Album(name=name, url="new-" + uuid.uuid4().hex, user_id=user_id)
+    db.session.add(album)
+    db.session.flush()
+    album.url = encode_slug(album.id)
+    db.session.commit()
+    return album
+
+
+def find_album(slug):
+    """The album of ``slug``, ``None`` if there is none.
+
+    Slugs of ``new_album`` decode to the primary key, looked up without
+    touching the url index. Legacy md5 slugs go through ``ix_album_url``.
+    """
+    album_id = decode_slug(slug)
+    if album_id is not None:
+        album = Album.query.get(album_id)
+        # An album with a legacy url is not reachable through its id
+        if album is not None and album.url == slug:
+            return album
+    return Album.query.filter(Album.url == slug).first()
+
+
+def encode_cursor(timestamp, album_id):
+    data = json.dumps([timestamp.isoformat(), album_id]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the ``(timestamp, id)`` of the last album of the previous page."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, album_id = json.loads(data)
+        return datetime.fromisoformat(timestamp), int(album_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def list_albums(user_id, limit=PAGE_SIZE, cursor=None):
+    """One page of the albums of ``user_id``, newest first.
+
+    Pages are keyed on ``(timestamp, id)`` rather than offsets, so each one
+    is an index range scan on ``ix_album_user_id_timestamp`` whatever its
+    depth. The image count and current photo of every album come from the
+    same query. Returns ``(albums, next_cursor)``, ``next_cursor`` being
+    ``None`` on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    current = aliased(Image)
+    image_count = (
+        db.session.query(func.count(Image.id))
+        .filter(Image.album_id == Album.id)
+        .correlate(Album)
+        .as_scalar()
+    )
+    query = (
+        db.session.query(Album, image_count, current)
+        .outerjoin(current, current.id == Album.last_photo_viewed_id)
+        .filter(Album.user_id == user_id)
+        .order_by(Album.timestamp.desc(), Album.id.desc())
+    )
+    if cursor is not None:
+        timestamp, album_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                Album.timestamp < timestamp,
+                and_(Album.timestamp == timestamp, Album.id < album_id),
+            )
+        )
+    rows = query.limit(limit + 1).all()
+
+    albums = [format_album(album, count, image) for album, count, image in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1][0]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    return albums, next_cursor
+
+
+def format_album(album, image_count, image=None):
+    return {
+        "id": album.id,
+        "name": album.name,
+        "url": album.url,
+        "timestamp": album.timestamp.isoformat() if album.timestamp else None,
+        "image_count": image_count,
+        "last_time_viewed": (
+            album.last_time_viewed.isoformat() if album.last_time_viewed else None
+        ),
+        "photo": (
+            None
+            if image is None
+            else {
+                "id": image.id,
+                "url": image.display_url(),
+                "thumbnail_url": image.thumbnail_url(),
+                "width": image.width,
+                "height": image.height,
+                "placeholder": image.placeholder,
+            }
+        ),
+    }
+
+
+def delete_albums(albums):
+    """Delete ``albums`` and their images, then clean their storage in a job.
+
+    The rows go in one transaction, images being removed by the database
+    through the ``ON DELETE CASCADE`` of ``image.album_id``. Photos still
+    used by other albums are kept. The objects to remove (orphan blobs,
+    album prefixes and legacy bucket-per-album buckets) are handed to the
+    ``delete_storage`` job. Returns its id, ``None`` if nothing was deleted.
+    """
+    if not albums:
+        return None
+    album_ids = [album.id for album in albums]
+    album_urls = [album.url for album in albums]
+    images = Image.query.filter(Image.album_id.in_(album_ids))
+
+    shared_prefix = storage.url("")
+    legacy_urls = (
+        images.filter(~Image.url.startswith(shared_prefix, autoescape=True))
+        .with_entities(func.min(Image.url))
+        .group_by(Image.album_id)
+        .all()
+    )
+    buckets = {storage.key_from_url(url)[0] for url, in legacy_urls}
+    buckets.discard(None)
+    buckets.discard(storage.bucket)
+
+    orphan_keys = release_images(images)
+    if db.engine.dialect.name == "sqlite":
+        # Foreign keys are only enforced by SQLite when enabled per connection
+        DailyPick.query.filter(DailyPick.album_id.in_(album_ids)).delete(
+            synchronize_session=False
+        )
+        images.delete(synchronize_session=False)
+    Album.query.filter(Album.id.in_(album_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    db.session.expire_all()
+
+    for album_url in album_urls:
+        response_cache.invalidate(album_url)
+    payload = {
+        "keys": orphan_keys,
+        "prefixes": [storage.album_prefix(album_url) for album_url in album_urls],
+        "buckets": sorted(buckets),
+    }
+    return jobs.enqueue(
+        "delete_storage",
+        payload,
+        total=len(payload["prefixes"]) + len(payload["buckets"]) + 1,
+    )
+
+
+@jobs.task("delete_storage")
+def delete_storage(payload, progress):
+    """Remove the objects of deleted albums, see ``delete_albums``."""
+    storage.delete_keys(payload["keys"])
+    progress.advance()
+    for prefix in payload["prefixes"]:
+        storage.delete_prefix(prefix)
+        progress.advance()
+    for bucket in payload["buckets"]:
+        storage.delete_bucket(bucket)
+        progress.advance()
@@ -0,0 +1,426 @@
+import base64
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from botocore.credentials import Credentials
+from sqlalchemy.engine.url import make_url
+
+from config import Config
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # pragma: no cover
+    PILImage = None
+
+DEFAULT_SIZES = (10, 1000, 100000)
+SEED_BATCH_SIZE = 10000
+
+
+class StubS3Client(object):
+    """Stands for the boto3 client of ``S3Storage``, without any network.
+
+    Uploads are read to the end so the spooled files are still streamed,
+    only their size is kept.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        size = 0
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+            size += len(chunk)
+        with self._lock:
+            self.objects[key] = size
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop(obj["Key"], None)
+        return {}
+
+
+def percentiles(samples):
+    """Summary of a list of durations in seconds, reported in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": rank(50) * 1000,
+        "p90_ms": rank(90) * 1000,
+        "p99_ms": rank(99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _b64_int(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def make_signing_key(directory):
+    """Write a JWKS with a fresh RSA key to ``directory``.
+
+    Returns ``(private_key_pem, jwks_url)``, the url being a ``file://`` one
+    the JWKS cache reads like the Auth0 endpoint.
+    """
+    import rsa
+
+    public_key, private_key = rsa.newkeys(2048)
+    jwks = {
+        "keys": [
+            {
+                "kty": "RSA",
+                "kid": "bench",
+                "use": "sig",
+                "n": _b64_int(public_key.n),
+                "e": _b64_int(public_key.e),
+            }
+        ]
+    }
+    path = os.path.join(directory, "jwks.json")
+    with open(path, "w") as f:
+        json.dump(jwks, f)
+    return private_key.save_pkcs1().decode(), "file://" + path
+
+
+def bench_config(database_url, workdir, jwks_url):
+    class BenchConfig(Config):
+        SECRET_KEY = "bench"
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+        WTF_CSRF_ENABLED = False
+        # Measure the views themselves, not the anonymous page cache
+        RESPONSE_CACHE_TYPE = "null"
+        JOB_QUEUE_TYPE = "memory"
+        JOB_WORKERS = 0
+        STORAGE_TYPE = "s3"
+        S3_BUCKET = "bench"
+        INGEST_SPOOL_DIR = os.path.join(workdir, "spool")
+        AUTH0_DOMAIN = "bench.invalid"
+        API_AUDIENCE = "bench"
+        JWKS_URL = jwks_url
+        QUERY_BUDGET = None
+        SESSION_TYPE = "memory"
+
+    return BenchConfig
+
+
+def seed_album(db, size, user_id="bench"):
+    """Insert an album of ``size`` images, ``SEED_BATCH_SIZE`` rows at a time."""
+    from app.models import Album, Image
+    from app.scheduler import roll_over
+
+    album = Album("bench {}".format(size), "bench-{}".format(size), user_id=user_id)
+    album.insert()
+    for start in range(0, size, SEED_BATCH_SIZE):
+        db.session.bulk_insert_mappings(
+            Image,
+            [
+                {
+                    "key": "albums/{}/{}.jpg".format(album.url, index),
+                    "album_id": album.id,
+                    "viewed": False,
+                }
+                for index in range(start, min(size, start + SEED_BATCH_SIZE))
+            ],
+        )
+        db.session.commit()
+    roll_over(album_ids=[album.id])
+    return album
+
+
+def _queries(query_stats, endpoint, before):
+    after = query_stats.snapshot().get(endpoint, {})
+    requests = after.get("requests", 0) - before.get("requests", 0)
+    queries = after.get("queries", 0) - before.get("queries", 0)
+    return queries / requests if requests else None
+
+
+def bench_get_album(app, album_url, requests, clients):
+    """Latency and throughput of the album page."""
+    from app import query_stats
+
+    samples = []
+    lock = threading.Lock()
+    before = query_stats.snapshot().get("main.get_album", {})
+
+    def client_loop(count):
+        client = app.test_client()
+        durations = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = client.get("/" + album_url)
+            durations.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    "GET /{} answered {}".format(album_url, response.status_code)
+                )
+        with lock:
+            samples.extend(durations)
+
+    per_client = max(1, requests // clients)
+    threads = [
+        threading.Thread(target=client_loop, args=(per_client,)) for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = percentiles(samples)
+    result["clients"] = clients
+    result["requests_per_second"] = len(samples) / elapsed if elapsed else None
+    result["queries_per_request"] = _queries(query_stats, "main.get_album", before)
+    return result
+
+
+def bench_rollover(app, album_id, iterations):
+    """Time the scheduler picking the photo of the next days of an album."""
+    from app.scheduler import pick_day, roll_over
+
+    samples = []
+    with app.app_context():
+        first_day = pick_day() + timedelta(days=1)
+        for index in range(iterations):
+            start = time.perf_counter()
+            roll_over(day=first_day + timedelta(days=index), album_ids=[album_id])
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def synthetic_photo(width=1600, height=1200):
+    """JPEG bytes of random content, so no two photos are deduplicated."""
+    if PILImage is None:
+        return b"\xff\xd8\xff\xe0" + os.urandom(width * height // 10)
+    image = PILImage.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def bench_create_album(app, files, iterations):
+    """Upload request latency and ingestion time of albums of ``files`` photos."""
+    from app import jobs
+    from app.main.ingest import ingest_job_id
+    from app.models import Album
+
+    client = app.test_client()
+    request_samples = []
+    ingest_samples = []
+    total_bytes = 0
+    for iteration in range(iterations):
+        photos = [synthetic_photo() for _ in range(files)]
+        total_bytes += sum(len(photo) for photo in photos)
+        data = {
+            "name": "bench upload {}".format(iteration),
+            "photo": [
+                (io.BytesIO(photo), "photo{}.jpg".format(index))
+                for index, photo in enumerate(photos)
+            ],
+        }
+        start = time.perf_counter()
+        response = client.post("/create", data=data, content_type="multipart/form-data")
+        request_samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError("POST /create answered {}".format(response.status_code))
+
+        start = time.perf_counter()
+        with app.app_context():
+            album_url = Album.query.order_by(Album.id.desc()).first().url
+        job_id = ingest_job_id(album_url)
+        # Run here, or wait for the job workers of another app of the process
+        while jobs.get(job_id)["state"] not in ("done", "failed"):
+            jobs.run_one(timeout=0.01)
+        ingest_samples.append(time.perf_counter() - start)
+        if jobs.get(job_id)["state"] != "done":
+            raise RuntimeError("Ingestion failed: {}".format(jobs.get(job_id)["error"]))
+
+    ingest_seconds = sum(ingest_samples)
+    return {
+        "files": files,
+        "iterations": iterations,
+        "request": percentiles(request_samples),
+        "ingest": percentiles(ingest_samples),
+        "files_per_second": (
+            files * iterations / ingest_seconds if ingest_seconds else None
+        ),
+        "megabytes_per_second": (
+            total_bytes / 1e6 / ingest_seconds if ingest_seconds else None
+        ),
+    }
+
+
+def bench_requires_auth(app, private_key, iterations):
+    """Cost of ``requires_auth`` for new tokens, cached tokens and a cold JWKS."""
+    from jose import jwt
+
+    from app import jwks_cache, token_cache
+    from app.main.routes import requires_auth
+
+    now = int(time.time())
+    token = jwt.encode(
+        {
+            "sub": "bench",
+            "aud": app.config["API_AUDIENCE"],
+            "iss": "https://" + app.config["AUTH0_DOMAIN"] + "/",
+            "iat": now,
+            "exp": now + 3600,
+            "permissions": ["get:albums"],
+        },
+        private_key,
+        algorithm="RS256",
+        headers={"kid": "bench"},
+    )
+    view = requires_auth("get:albums")(lambda payload: payload)
+
+    def measure(before_call):
+        samples = []
+        with app.test_request_context("/"):
+            from flask import session
+
+            session["jwt_payload"] = {"access_token": token}
+            for _ in range(iterations):
+                before_call()
+                start = time.perf_counter()
+                view()
+                samples.append(time.perf_counter() - start)
+        return percentiles(samples)
+
+    return {
+        "verify": measure(token_cache.clear),
+        "cached": measure(lambda: None),
+        "cold_jwks": measure(lambda: (token_cache.clear(), jwks_cache.clear())),
+    }
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configured_database(database_url):
+    """Whether ``database_url`` is the database or a replica the app runs on."""
+    url = make_url(database_url)
+    for configured in [Config.SQLALCHEMY_DATABASE_URI] + list(
+        Config.SQLALCHEMY_BINDS.values()
+    ):
+        if not configured:
+            continue
+        configured = make_url(configured)
+        if (url.host, url.port, url.database) == (
+            configured.host,
+            configured.port,
+            configured.database,
+        ):
+            return True
+    return False
+
+
+def run_benchmarks(
+    output,
+    database_url=None,
+    sizes=DEFAULT_SIZES,
+    requests=200,
+    clients=4,
+    files=20,
+    upload_iterations=3,
+    auth_iterations=200,
+    drop=False,
+):
+    """Run every benchmark on a scratch database and write the results to ``output``.
+
+    ``database_url`` defaults to a temporary SQLite file. Any other database
+    is emptied, its tables are dropped and created again, so it needs
+    ``drop`` and can't be the one ``SQLALCHEMY_DATABASE_URI`` or a replica
+    url points to.
+    """
+    from app import create_app, db, storage
+
+    if database_url is not None:
+        # repr hides the password
+        shown = repr(make_url(database_url))
+        if configured_database(database_url):
+            raise ValueError(
+                "{} is the database of the app, bench on a scratch one".format(shown)
+            )
+        if not drop:
+            raise ValueError(
+                "Every table of {} would be dropped, confirm with --yes-drop".format(
+                    shown
+                )
+            )
+
+    workdir = tempfile.mkdtemp(prefix="1pic1day-bench-")
+    if database_url is None:
+        database_url = "sqlite:///" + os.path.join(workdir, "bench.db")
+    private_key, jwks_url = make_signing_key(workdir)
+    app = create_app(bench_config(database_url, workdir, jwks_url))
+    storage.backend.client = StubS3Client()
+    storage.backend.credentials = Credentials("bench", "bench")
+    random.seed(0)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "database": database_url.split(":", 1)[0],
+        "parameters": {
+            "sizes": list(sizes),
+            "requests": requests,
+            "clients": clients,
+            "files": files,
+            "upload_iterations": upload_iterations,
+            "auth_iterations": auth_iterations,
+        },
+        "get_album": {},
+        "rollover": {},
+    }
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    for size in sizes:
+        with app.app_context():
+            start = time.perf_counter()
+            album = seed_album(db, size)
+            album_id, album_url = album.id, album.url
+        print("Seeded {} images in {:.1f}s".format(size, time.perf_counter() - start))
+        results["get_album"][str(size)] = bench_get_album(
+            app, album_url, requests, clients
+        )
+        results["rollover"][str(size)] = bench_rollover(
+            app, album_id, max(1, requests // 10)
+        )
+
+    results["create_album"] = bench_create_album(app, files, upload_iterations)
+    results["requires_auth"] = bench_requires_auth(app, private_key, auth_iterations)
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return results
@@ -0,0 +1,83 @@
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.models import Blob, Image
+
+
+def blob_key(sha256, filename, unique=False):
+    """Content addressed key, identical uploads always map to the same object.
+
+    ``unique`` appends a random suffix, for a blob stored again while the
+    objects of its deleted predecessor may still be queued for deletion.
+    """
+    extension = secure_filename(filename).rsplit(".", 1)[-1].lower()
+    if unique:
+        sha256 = "{}-{}".format(sha256, uuid.uuid4().hex[:8])
+    return "blobs/{}/{}.{}".format(sha256[:2], sha256, extension)
+
+
+def find_blobs(digests):
+    """Map each already stored digest of ``digests`` to its Blob."""
+    if not digests:
+        return {}
+    return {
+        blob.sha256: blob
+        for blob in Blob.query.filter(Blob.sha256.in_(set(digests))).all()
+    }
+
+
+def add_blob(blob):
+    """Insert ``blob``, or return the row a concurrent ingestion inserted first."""
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+        return blob
+    except IntegrityError:
+        return Blob.query.filter(Blob.sha256 == blob.sha256).one()
+
+
+def acquire(blob_counts):
+    """Add references to blobs, ``blob_counts`` maps blob ids to a count.
+
+    Returns the ids of the blobs that no longer exist.
+    """
+    missing = []
+    for blob_id, count in blob_counts.items():
+        updated = Blob.query.filter(Blob.id == blob_id).update(
+            {Blob.refcount: Blob.refcount + count}, synchronize_session=False
+        )
+        if not updated:
+            missing.append(blob_id)
+    return missing
+
+
+def release_images(images_query):
+    """Drop the blob references of the images matched by ``images_query``.
+
+    Blobs left without reference are deleted, and the storage keys of their
+    objects are returned so the caller can remove them once the transaction
+    is committed. The caller deletes the images and commits.
+    """
+    counts = dict(
+        images_query.filter(Image.blob_id.isnot(None))
+        .with_entities(Image.blob_id, func.count(Image.id))
+        .group_by(Image.blob_id)
+        .all()
+    )
+    if not counts:
+        return []
+    acquire({blob_id: -count for blob_id, count in counts.items()})
+    orphans = Blob.query.filter(Blob.id.in_(list(counts)), Blob.refcount <= 0).all()
+    keys = [key for blob in orphans for key in blob.keys()]
+    orphan_ids = [blob.id for blob in orphans]
+    if orphan_ids:
+        # The images pointing to them are about to be deleted by the caller
+        images_query.filter(Image.blob_id.in_(orphan_ids)).update(
+            {Image.blob_id: None}, synchronize_session=False
+        )
+        Blob.query.filter(Blob.id.in_(orphan_ids)).delete(synchronize_session=False)
+    return keys
@@ -0,0 +1,157 @@
+import hashlib
+import pickle
+import threading
+import time
+
+from flask import request, make_response
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+
+class MemoryBackend(object):
+    """Per-process backend, each gunicorn worker keeps its own copy."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.time()
+                for k in [k for k, (_, e) in self._entries.items() if e <= now]:
+                    del self._entries[k]
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (value, time.time() + timeout)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend(object):
+    """Backend shared by every worker and instance through Redis."""
+
+    def __init__(self, url, prefix="1pic1day:"):
+        if redis is None:
+            raise RuntimeError(
+                "The redis backend requires the redis extra: poetry install -E redis"
+            )
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(int(timeout), 1))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class NullBackend(object):
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class ResponseCache(object):
+    """Rendered album pages for anonymous viewers, valid until the next pick.
+
+    Entries are keyed by album url and only live for the current pick window
+    (the "day bucket"), so they never need to be invalidated when a new photo
+    is picked, only when the album itself changes. Invalidations can't reach
+    the other processes of the "simple" backend, its entries live at most
+    ``RESPONSE_CACHE_SIMPLE_TIMEOUT`` seconds.
+    """
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.max_timeout = None
+
+    def init_app(self, app):
+        cache_type = app.config.get("RESPONSE_CACHE_TYPE", "simple")
+        self.max_timeout = None
+        if cache_type == "simple":
+            self.backend = MemoryBackend(
+                app.config.get("RESPONSE_CACHE_MAX_ENTRIES", 1024)
+            )
+            self.max_timeout = app.config.get("RESPONSE_CACHE_SIMPLE_TIMEOUT", 30)
+        elif cache_type == "redis":
+            self.backend = RedisBackend(app.config.get("RESPONSE_CACHE_URL"))
+        elif cache_type == "null":
+            self.backend = NullBackend()
+        else:
+            raise ValueError("Unknown RESPONSE_CACHE_TYPE {}".format(cache_type))
+
+    @staticmethod
+    def _key(album_url):
+        return "album:" + album_url
+
+    def get(self, album_url):
+        entry = self.backend.get(self._key(album_url))
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        return entry
+
+    def set(self, album_url, body, expires_in):
+        """Store ``body`` for ``expires_in`` seconds and return the entry."""
+        if self.max_timeout is not None:
+            expires_in = min(expires_in, self.max_timeout)
+        entry = {
+            "body": body,
+            "etag": hashlib.sha1(body.encode("utf-8")).hexdigest(),
+            "expires_at": time.time() + max(expires_in, 0),
+        }
+        if expires_in > 0:
+            self.backend.set(self._key(album_url), entry, expires_in)
+        return entry
+
+    def invalidate(self, album_url):
+        self.backend.delete(self._key(album_url))
+
+    def make_response(self, entry):
+        """Build the response for ``entry``, a 304 if the client already has it."""
+        max_age = max(int(entry["expires_at"] - time.time()), 0)
+        if entry["etag"] in request.if_none_match:
+            response = make_response("", 304)
+        else:
+            response = make_response(entry["body"])
+        response.set_etag(entry["etag"])
+        response.headers["Cache-Control"] = "public, max-age={}".format(max_age)
+        # Logged in viewers get a different page for the same url.
+        response.vary.add("Cookie")
+        return response
@@ -0,0 +1,272 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db, storage
+from app.metadata import PILImage, HEADER_BYTES, read_header, make_placeholder
+from app.models import Album, Image, Blob
+
+
+def migrate_storage(batch_size=500, delete_old=False, workers=8):
+    """Copy the objects of bucket-per-album albums into the shared bucket.
+
+    Images are moved ``batch_size`` at a time: their objects are copied to
+    ``albums/<album url>/`` in parallel, then the batch of images gets its
+    new ``key`` in place of the legacy ``url`` and is committed, so the
+    command can be stopped and resumed. Albums already in the shared bucket
+    are skipped.
+    """
+    shared_prefix = storage.url("")
+    albums = Album.query.order_by(Album.id).all()
+    for album in albums:
+        old_buckets = set()
+        prefix = storage.album_prefix(album.url)
+        while True:
+            images = (
+                Image.query.filter(
+                    Image.album_id == album.id,
+                    ~Image.url.startswith(shared_prefix, autoescape=True),
+                )
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not images:
+                break
+
+            moves = []
+            for image in images:
+                bucket, key = storage.key_from_url(image.url)
+                old_buckets.add(bucket)
+                moves.append((image, bucket, key, prefix + key.rsplit("/", 1)[-1]))
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(
+                    pool.map(
+                        lambda move: storage.copy(move[1], move[2], move[3]), moves
+                    )
+                )
+
+            db.session.bulk_update_mappings(
+                Image,
+                [
+                    {"id": image.id, "key": key, "url": None}
+                    for image, _, _, key in moves
+                ],
+            )
+            db.session.commit()
+            print("{}: moved {} images".format(album.url, len(moves)))
+
+        if delete_old:
+            for bucket in old_buckets:
+                storage.delete_bucket(bucket)
+                print("{}: deleted bucket {}".format(album.url, bucket))
+
+
+def backfill_image_keys(batch_size=1000):
+    """Replace the urls of images in the shared storage by their key.
+
+    Rows are rewritten ``batch_size`` at a time in id order and each batch
+    is committed, so the command can be stopped and resumed. The urls kept
+    in the variants of images and blobs are dropped as well, their keys are
+    enough. Images of bucket-per-album albums keep their url until
+    ``migrate_storage`` moves them. Returns the number of images updated.
+    """
+    shared_prefix = storage.url("")
+    updated = 0
+    after = 0
+    while True:
+        images = (
+            db.session.query(Image.id, Image.url, Image.variants)
+            .filter(
+                Image.id > after,
+                Image.key.is_(None),
+                Image.url.startswith(shared_prefix, autoescape=True),
+            )
+            .order_by(Image.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not images:
+            break
+        after = images[-1].id
+        mappings = []
+        for image in images:
+            mapping = {
+                "id": image.id,
+                "key": storage.key_from_url(image.url)[1],
+                "url": None,
+            }
+            if image.variants is not None:
+                mapping["variants"] = strip_variant_urls(image.variants)
+            mappings.append(mapping)
+        db.session.bulk_update_mappings(Image, mappings)
+        db.session.commit()
+        updated += len(images)
+        print("Backfilled the keys of {} images".format(updated))
+
+    after = 0
+    while True:
+        blobs = (
+            db.session.query(Blob.id, Blob.variants)
+            .filter(Blob.id > after)
+            .order_by(Blob.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not blobs:
+            break
+        after = blobs[-1].id
+        db.session.bulk_update_mappings(
+            Blob,
+            [
+                {"id": blob.id, "variants": strip_variant_urls(blob.variants)}
+                for blob in blobs
+                if any("url" in variant for variant in blob.variants or [])
+            ],
+        )
+        db.session.commit()
+    return updated
+
+
+def strip_variant_urls(variants):
+    return [
+        (
+            {name: value for name, value in variant.items() if name != "url"}
+            if "key" in variant
+            else variant
+        )
+        for variant in variants
+    ]
+
+
+def read_stored_metadata(image):
+    """Metadata columns of a stored image, ``None`` if it can't be read.
+
+    Only the first ``HEADER_BYTES`` of the photo are fetched for its header,
+    the whole object if its EXIF is larger. The placeholder is made from
+    the smallest resized copy, or from the original when it has none.
+    """
+    try:
+        data, size = storage.read_bytes(image.key, HEADER_BYTES)
+        try:
+            metadata = read_header(io.BytesIO(data))
+        except Exception:
+            if len(data) >= size:
+                raise
+            data, size = storage.read_bytes(image.key)
+            metadata = read_header(io.BytesIO(data))
+        metadata["size"] = size
+
+        copies = [
+            variant
+            for variant in image.variants or []
+            if variant["mimetype"] == "image/jpeg"
+            and not variant["thumbnail"]
+            and "key" in variant
+        ]
+        if copies:
+            smallest = min(copies, key=lambda variant: variant["width"])
+            data = storage.read_bytes(smallest["key"])[0]
+        elif len(data) < size:
+            data = storage.read_bytes(image.key)[0]
+        metadata["placeholder"] = make_placeholder(io.BytesIO(data))
+        return metadata
+    except Exception as e:
+        print("{}: {}".format(image.key, e))
+        return None
+
+
+def backfill_image_metadata(batch_size=200, workers=8):
+    """Read the metadata of the images ingested before it was stored.
+
+    Images without a width are taken ``batch_size`` at a time in id order,
+    their photos read by a pool of ``workers`` threads with
+    ``read_stored_metadata``, and each batch is committed, so the command
+    can be stopped and resumed. Images that can't be read are skipped, as
+    are those of bucket-per-album albums, which have no key. Returns the
+    number of images updated.
+    """
+    if PILImage is None:
+        raise RuntimeError("Reading the image metadata requires Pillow")
+    updated = 0
+    after = 0
+    while True:
+        images = (
+            db.session.query(Image.id, Image.key, Image.variants)
+            .filter(Image.id > after, Image.key.isnot(None), Image.width.is_(None))
+            .order_by(Image.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not images:
+            break
+        after = images[-1].id
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(read_stored_metadata, images))
+        mappings = [
+            dict(metadata, id=image.id)
+            for image, metadata in zip(images, results)
+            if metadata is not None
+        ]
+        db.session.bulk_update_mappings(Image, mappings)
+        db.session.commit()
+        updated += len(mappings)
+        print("Read the metadata of {} images".format(updated))
+    return updated
+
+
+def hot_queries():
+    """The lookups run on every page view, each must be served by an index."""
+    return {
+        "album by url": Album.query.filter(Album.url == "abc"),
+        "albums of a user": Album.query.filter(Album.user_id == "auth0|abc"),
+        "page of a user's albums": Album.query.filter(
+            Album.user_id == "auth0|abc"
+        ).order_by(Album.timestamp.desc(), Album.id.desc()),
+        "unviewed images of an album": Image.query.filter(
+            Image.album_id == 1, Image.viewed.is_(False)
+        ),
+        "images of an album": Image.query.filter(Image.album_id == 1),
+    }
+
+
+def explain(query):
+    dialect = db.engine.dialect
+    sql = str(
+        query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    )
+    if dialect.name == "sqlite":
+        rows = db.session.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        return "\n".join(str(row[-1]) for row in rows)
+    rows = db.session.execute("EXPLAIN " + sql).fetchall()
+    return "\n".join(str(row[0]) for row in rows)
+
+
+def uses_index(plan, dialect_name):
+    if dialect_name == "sqlite":
+        return all(
+            "USING INDEX" in line
+            or "USING COVERING INDEX" in line
+            or "USING INTEGER PRIMARY KEY" in line
+            for line in plan.splitlines()
+            if line.startswith(("SCAN", "SEARCH"))
+        )
+    return "Seq Scan" not in plan and "Index" in plan
+
+
+def check_query_plans():
+    """Return ``{name: plan}`` of the hot queries that would scan a whole table.
+
+    On PostgreSQL sequential scans are disabled for the check, otherwise the
+    planner picks them on small tables whatever the indexes.
+    """
+    dialect_name = db.engine.dialect.name
+    if dialect_name == "postgresql":
+        db.session.execute("SET LOCAL enable_seqscan = off")
+    failures = {}
+    for name, query in hot_queries().items():
+        plan = explain(query)
+        if not uses_index(plan, dialect_name):
+            failures[name] = plan
+    db.session.rollback()
+    return failures
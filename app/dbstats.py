@@ -0,0 +1,124 @@
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def engine_options(app):
+    """SQLAlchemy engine options built from the DB_* settings of ``app``."""
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI") or ""
+    if uri.startswith("sqlite"):
+        # SQLite uses a single connection or NullPool, no pool to size
+        return {}
+    options = {
+        "pool_size": app.config.get("DB_POOL_SIZE", 5),
+        "max_overflow": app.config.get("DB_MAX_OVERFLOW", 10),
+        "pool_recycle": app.config.get("DB_POOL_RECYCLE", 1800),
+        "pool_timeout": app.config.get("DB_POOL_TIMEOUT", 30),
+        "pool_pre_ping": app.config.get("DB_POOL_PRE_PING", True),
+    }
+    return options
+
+
+def pool_status(engine):
+    """Size and usage of the connection pool of ``engine``."""
+    pool = engine.pool
+    status = {"class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+
+def _statement_timeout(conn, branch):
+    """Cap the statements of web requests at ``DB_STATEMENT_TIMEOUT`` ms.
+
+    Commands (migrations, scheduler, backfills) run without a timeout. The
+    setting is kept by the pooled connection, so it is only sent when a
+    connection moves between a request and a command.
+    """
+    if branch or conn.dialect.name != "postgresql":
+        return
+    timeout = 0
+    if has_request_context():
+        timeout = int(current_app.config.get("DB_STATEMENT_TIMEOUT") or 0)
+    dbapi_connection = conn.connection
+    if dbapi_connection.info.get("statement_timeout", 0) == timeout:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SET statement_timeout = {}".format(timeout))
+    finally:
+        cursor.close()
+    # Outside of the transaction of the caller, a rollback would revert it
+    dbapi_connection.commit()
+    dbapi_connection.info["statement_timeout"] = timeout
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get("query_start"):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_time = g.get("query_time", 0.0) + elapsed
+
+
+class QueryStats(object):
+    """Number and duration of the SQL queries run by each endpoint.
+
+    Requests running more than ``QUERY_BUDGET`` queries (or the endpoint's
+    entry in ``QUERY_BUDGETS``) are logged as warnings.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        if not app.config.get("SQLALCHEMY_ENGINE_OPTIONS"):
+            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app)
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "engine_connect", _statement_timeout)
+        app.after_request(self._record)
+
+    def budget(self, endpoint):
+        budgets = self.app.config.get("QUERY_BUDGETS") or {}
+        return budgets.get(endpoint, self.app.config.get("QUERY_BUDGET", 10))
+
+    def _record(self, response):
+        endpoint = request.endpoint or "unknown"
+        count = g.get("query_count", 0)
+        seconds = g.get("query_time", 0.0)
+        with self._lock:
+            stats = self.endpoints.setdefault(
+                endpoint,
+                {"requests": 0, "queries": 0, "seconds": 0.0, "max_queries": 0},
+            )
+            stats["requests"] += 1
+            stats["queries"] += count
+            stats["seconds"] += seconds
+            stats["max_queries"] = max(stats["max_queries"], count)
+        budget = self.budget(endpoint)
+        if budget is not None and count > budget:
+            self.app.logger.warning(
+                "%s ran %d queries (%.1f ms), over its budget of %d",
+                endpoint,
+                count,
+                seconds * 1000,
+                budget,
+            )
+        return response
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self.endpoints.items()}
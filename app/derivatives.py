@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # pragma: no cover
+    PILImage = None
+
+try:
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+except ImportError:  # pragma: no cover
+    pass
+
+# Widths of the web sized copies, the originals are never upscaled
+WIDTHS = (480, 1024, 1920)
+THUMBNAIL_WIDTH = 200
+FORMATS = (("webp", "WEBP", "image/webp"), ("jpg", "JPEG", "image/jpeg"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def process_pool(workers=None):
+    """Pool of processes decoding photos, shared by every job of the process.
+
+    Created on first use with ``workers`` processes (the CPU count by
+    default). They are started by a fork server rather than forked from
+    the app process, whose threads, database connections and boto clients
+    must not be inherited.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            _pool = ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(), mp_context=context
+            )
+        return _pool
+
+
+def map_in_pool(function, items, workers=None):
+    """``list(map(function, items))`` run on the ``process_pool``."""
+    global _pool
+    pool = process_pool(workers)
+    try:
+        return list(pool.map(function, items))
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory), the next call starts a new pool
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def make_derivatives(path, widths=WIDTHS, thumbnail_width=THUMBNAIL_WIDTH):
+    """Decode the image at ``path`` once and write its resized copies next to it.
+
+    Returns a list of ``{"path", "suffix", "width", "height", "mimetype"}``,
+    empty if Pillow is missing or the file can't be decoded. Runs in a worker
+    process, so it only takes and returns picklable values.
+    """
+    if PILImage is None:
+        return []
+    try:
+        with PILImage.open(path) as source:
+            image = ImageOps.exif_transpose(source).convert("RGB")
+    except Exception:
+        return []
+
+    variants = []
+    sizes = {width for width in widths if width < image.width}
+    sizes.add(min(widths[-1], image.width))
+    for width in sorted(sizes):
+        suffix = "w{}".format(width)
+        height = round(image.height * width / image.width)
+        resized = (
+            image
+            if width == image.width
+            else image.resize((width, height), PILImage.LANCZOS)
+        )
+        for extension, image_format, mimetype in FORMATS:
+            variant_path = "{}.{}.{}".format(path, suffix, extension)
+            resized.save(variant_path, image_format, quality=82, optimize=True)
+            variants.append(
+                {
+                    "path": variant_path,
+                    "suffix": "{}.{}".format(suffix, extension),
+                    "width": width,
+                    "height": height,
+                    "mimetype": mimetype,
+                }
+            )
+
+    thumbnail = ImageOps.fit(
+        image, (thumbnail_width, thumbnail_width), PILImage.LANCZOS
+    )
+    thumbnail_path = "{}.thumb.jpg".format(path)
+    thumbnail.save(thumbnail_path, "JPEG", quality=80, optimize=True)
+    variants.append(
+        {
+            "path": thumbnail_path,
+            "suffix": "thumb.jpg",
+            "width": thumbnail_width,
+            "height": thumbnail_width,
+            "mimetype": "image/jpeg",
+        }
+    )
+    return variants
+
+
+def make_all_derivatives(paths, workers=None):
+    """Run ``make_derivatives`` for every path on a pool of processes."""
+    if PILImage is None or not paths:
+        return [[] for _ in paths]
+    return map_in_pool(make_derivatives, paths, workers)
@@ -1,7 +1,7 @@
 from flask import render_template, session
 from app import db
 from app.errors import bp
-import json
+from app.sessions import pretty_payload
 
 
 class AuthError(Exception):
@@ -17,7 +17,7 @@ def auth_error(e):
         return render_template(
             "errors/auth_error.html",
             userinfo=session["profile"],
-            userinfo_pretty=json.dumps(session["jwt_payload"], indent=4),
+            userinfo_pretty=pretty_payload(),
             logged_in=True,
             auth_error=e.status_code,
         )
@@ -30,38 +30,47 @@ def auth_error(e):
 @bp.app_errorhandler(401)
 def unauthorized(error):
     if "profile" in session:
-        return render_template(
-            "errors/401.html",
-            userinfo=session["profile"],
-            userinfo_pretty=json.dumps(session["jwt_payload"], indent=4),
-            logged_in=True,
+        return (
+            render_template(
+                "errors/401.html",
+                userinfo=session["profile"],
+                userinfo_pretty=pretty_payload(),
+                logged_in=True,
+            ),
+            401,
         )
     else:
-        return render_template("errors/401.html", logged_in=False)
+        return render_template("errors/401.html", logged_in=False), 401
 
 
 @bp.app_errorhandler(404)
 def not_found(error):
     if "profile" in session:
-        return render_template(
-            "errors/404.html",
-            userinfo=session["profile"],
-            userinfo_pretty=json.dumps(session["jwt_payload"], indent=4),
-            logged_in=True,
+        return (
+            render_template(
+                "errors/404.html",
+                userinfo=session["profile"],
+                userinfo_pretty=pretty_payload(),
+                logged_in=True,
+            ),
+            404,
         )
     else:
-        return render_template("errors/404.html", logged_in=False)
+        return render_template("errors/404.html", logged_in=False), 404
 
 
 @bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     if "profile" in session:
-        return render_template(
-            "errors/500.html",
-            userinfo=session["profile"],
-            userinfo_pretty=json.dumps(session["jwt_payload"], indent=4),
-            logged_in=True,
+        return (
+            render_template(
+                "errors/500.html",
+                userinfo=session["profile"],
+                userinfo_pretty=pretty_payload(),
+                logged_in=True,
+            ),
+            500,
         )
     else:
-        return render_template("errors/500.html", logged_in=False)
+        return render_template("errors/500.html", logged_in=False), 500
@@ -0,0 +1,280 @@
+import json
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class MemoryJobStore(object):
+    """Jobs kept in the worker process, only visible to that process."""
+
+    durable = False
+
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._pending = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = job
+            finished = [j for j in self._jobs.values() if j["state"] in (DONE, FAILED)]
+            if len(finished) > self.max_finished:
+                finished.sort(key=lambda j: j["updated_at"])
+                for j in finished[: len(finished) - self.max_finished]:
+                    del self._jobs[j["id"]]
+        self._pending.put(job["id"])
+
+    def claim(self, timeout=1.0):
+        try:
+            job_id = self._pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return self.update(job_id, state=RUNNING)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=time.time())
+            return dict(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+class SQLiteJobStore(object):
+    """Jobs in a SQLite file shared by every worker process of the host.
+
+    A running job whose ``updated_at`` is older than ``lease`` seconds was
+    left by a process that died, it is claimed again.
+    """
+
+    durable = True
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, task TEXT NOT NULL, payload TEXT NOT NULL, "
+                "state TEXT NOT NULL, total INTEGER NOT NULL, done INTEGER NOT NULL, "
+                "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs (state, created_at)"
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def put(self, job):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, task, payload, state, total, done, "
+            "error, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job["id"],
+                job["task"],
+                json.dumps(job["payload"]),
+                job["state"],
+                job["total"],
+                job["done"],
+                job["error"],
+                job["created_at"],
+                job["updated_at"],
+            ),
+        )
+
+    def claim(self, timeout=1.0):
+        connection = self._connect()
+        deadline = time.time() + timeout
+        while True:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE state = ? "
+                    "OR (state = ? AND updated_at < ?) ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, time.time() - self.lease),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, time.time(), row["id"]),
+                    )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            if row is not None:
+                return self.get(row["id"])
+            if time.time() >= deadline:
+                return None
+            time.sleep(min(0.2, timeout))
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join("{} = ?".format(column) for column in fields)
+        self._connect().execute(
+            "UPDATE jobs SET {} WHERE id = ?".format(columns),
+            list(fields.values()) + [job_id],
+        )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = (
+            self._connect()
+            .execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            .fetchone()
+        )
+        return self._row_to_job(row)
+
+
+class Progress(object):
+    """Handed to tasks so they can report how far they got."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        self.done = 0
+
+    def set_total(self, total):
+        self.store.update(self.job_id, total=total)
+
+    def advance(self, count=1):
+        with self._lock:
+            self.done += count
+            self.store.update(self.job_id, done=self.done)
+
+
+class JobQueue(object):
+    """Background jobs run by a pool of worker threads in each app process.
+
+    Tasks are registered by name with the ``task`` decorator and receive
+    their JSON payload and a ``Progress``. ``JOB_QUEUE_TYPE`` selects the
+    store: "sqlite" (``JOB_QUEUE_PATH``, shared by the gunicorn workers of a
+    host, the default) or "memory" (per process, lost with it).
+
+    The ``JOB_WORKERS`` threads start with the first request served, once
+    every task is registered, so commands like ``manage.py db upgrade``
+    never claim a job. While a job runs its ``updated_at`` is refreshed
+    every third of ``JOB_LEASE`` seconds, the lease after which the SQLite
+    store hands it to another worker.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.store = MemoryJobStore()
+        self.tasks = {}
+        self.lease = 300
+        self._threads = []
+
+    def init_app(self, app):
+        self.app = app
+        self.lease = app.config.get("JOB_LEASE", 300)
+        queue_type = app.config.get("JOB_QUEUE_TYPE", "sqlite")
+        if queue_type == "memory":
+            self.store = MemoryJobStore()
+        elif queue_type == "sqlite":
+            self.store = SQLiteJobStore(app.config.get("JOB_QUEUE_PATH"), self.lease)
+        else:
+            raise ValueError("Unknown JOB_QUEUE_TYPE {}".format(queue_type))
+        app.before_first_request(self._start_workers)
+
+    def task(self, name):
+        def decorator(f):
+            self.tasks[name] = f
+            return f
+
+        return decorator
+
+    def enqueue(self, task, payload, job_id=None, total=0):
+        now = time.time()
+        job = {
+            "id": job_id or uuid.uuid4().hex,
+            "task": task,
+            "payload": payload,
+            "state": QUEUED,
+            "total": total,
+            "done": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.put(job)
+        return job["id"]
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    @property
+    def durable(self):
+        """Whether jobs outlive the process, a missing one was then lost."""
+        return self.store.durable
+
+    def _start_workers(self):
+        self.start(self.app.config.get("JOB_WORKERS", 2))
+
+    def start(self, workers):
+        for _ in range(workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def run_one(self, timeout=1.0):
+        """Claim and run a single job, returns it or None if the queue is empty."""
+        job = self.store.claim(timeout=timeout)
+        if job is None:
+            return None
+        stop = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, args=(job["id"], stop), daemon=True
+        ).start()
+        try:
+            with self.app.app_context():
+                self.tasks[job["task"]](job["payload"], Progress(self.store, job["id"]))
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            return self.store.update(job["id"], state=FAILED, error=str(e))
+        finally:
+            stop.set()
+        return self.store.update(job["id"], state=DONE)
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.lease / 3):
+            self.store.update(job_id)
+
+    def _work(self):
+        while True:
+            try:
+                self.run_one()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                time.sleep(1)
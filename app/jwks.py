@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+from app.metrics import timed, JWKS_FETCH_SECONDS
+
+
+class JWKSCache(object):
+    """Process-wide store of the Auth0 signing keys, indexed by ``kid``.
+
+    Keys are fetched once and served from memory until ``ttl`` expires.
+    An unknown ``kid`` triggers a single refresh shared by every waiting
+    thread. Expired keys keep being served while a refresh is running and,
+    when it fails, until ``min_refresh_interval`` has passed since it
+    started (stale-while-revalidate), instead of failing or stalling every
+    authenticated request while the issuer is unreachable.
+    ``url`` can point to a local file (``file:///path/jwks.json``) or a stub
+    server for testing.
+    """
+
+    def __init__(self, ttl=600, min_refresh_interval=30, timeout=5, fetch=None):
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._fetch = fetch or self._urlopen_json
+        self._lock = threading.Lock()
+        self._url = None
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+
+    def init_app(self, app):
+        self.ttl = app.config.get("JWKS_CACHE_TTL", self.ttl)
+        self.min_refresh_interval = app.config.get(
+            "JWKS_MIN_REFRESH_INTERVAL", self.min_refresh_interval
+        )
+
+    def _urlopen_json(self, url):
+        with urlopen(url, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    @staticmethod
+    def _parse(jwks):
+        keys = {}
+        for key in jwks.get("keys", []):
+            if key.get("kty") != "RSA" or "kid" not in key:
+                continue
+            keys[key["kid"]] = {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key.get("use", "sig"),
+                "n": key["n"],
+                "e": key["e"],
+            }
+        return keys
+
+    def _is_fresh(self, now):
+        return now - self._fetched_at < self.ttl
+
+    def _recently_attempted(self, url, now):
+        return (
+            url == self._url
+            and bool(self._keys)
+            and now - self._attempted_at < self.min_refresh_interval
+        )
+
+    def refresh(self, url):
+        """Fetch the key set from ``url`` and replace the cached keys."""
+        self._attempted_at = time.monotonic()
+        with timed(JWKS_FETCH_SECONDS):
+            jwks = self._fetch(url)
+        keys = self._parse(jwks)
+        self._keys = keys
+        self._url = url
+        self._fetched_at = time.monotonic()
+        return keys
+
+    def get_key(self, kid, url):
+        """Return the RSA key for ``kid`` or ``None`` if the issuer has none."""
+        now = time.monotonic()
+        if url == self._url:
+            key = self._keys.get(kid)
+            if key is not None and self._is_fresh(now):
+                return key
+        else:
+            key = None
+
+        # A refresh is running or was just tried: serve what is known, stale
+        # keys included, and don't hammer the issuer for forged kids.
+        if self._recently_attempted(url, now):
+            return key
+
+        # Only one thread refreshes, the others wait and reuse its result.
+        generation = self._fetched_at
+        with self._lock:
+            if url == self._url and self._fetched_at != generation:
+                return self._keys.get(kid)
+            if self._recently_attempted(url, time.monotonic()):
+                return self._keys.get(kid)
+
+            try:
+                keys = self.refresh(url)
+            except Exception:
+                if url == self._url and self._keys:
+                    return self._keys.get(kid)
+                raise
+            return keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._url = None
+            self._keys = {}
+            self._fetched_at = 0.0
+            self._attempted_at = 0.0
@@ -22,20 +22,24 @@ class MultiFileAllowed(object):
             filename = data.filename.lower()
 
             if isinstance(self.upload_set, Iterable):
-                if any(filename.endswith("." + x) for x in self.upload_set):
-                    return
-
+                if not any(filename.endswith("." + x) for x in self.upload_set):
+                    raise StopValidation(
+                        self.message
+                        or field.gettext(
+                            "File does not have an approved extension: {extensions}"
+                        ).format(extensions=", ".join(self.upload_set))
+                    )
+
+            elif not self.upload_set.file_allowed(data, filename):
                 raise StopValidation(
                     self.message
-                    or field.gettext(
-                        "File does not have an approved extension: {extensions}"
-                    ).format(extensions=", ".join(self.upload_set))
+                    or field.gettext("File does not have an approved extension.")
                 )
 
-            if not self.upload_set.file_allowed(field.data, filename):
+            # Streamed uploads already know their first bytes, no need to read
+            if getattr(data.stream, "is_image", True) is False:
                 raise StopValidation(
-                    self.message
-                    or field.gettext("File does not have an approved extension.")
+                    self.message or field.gettext("File is not an image.")
                 )
 
 
@@ -0,0 +1,401 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from app import db, jobs, storage, response_cache
+from app.blobs import blob_key, find_blobs, add_blob, acquire
+from app.derivatives import make_all_derivatives
+from app.metadata import extract_all_metadata
+from app.models import Album, Image, Blob
+from app.scheduler import roll_over
+from app.streaming import SpoolFile
+from app.uploads import make_key
+
+# Times the references to reused blobs are taken before giving up
+INGEST_ATTEMPTS = 3
+
+# Content type each direct upload must declare, by file extension
+PHOTO_MIMETYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "heic": "image/heic",
+}
+
+
+class SpooledFile(object):
+    """An upload saved to disk, only opened while it is being sent."""
+
+    def __init__(self, path, filename, mimetype):
+        self.path = path
+        self.filename = filename
+        self.mimetype = mimetype
+
+    @property
+    def stream(self):
+        return open(self.path, "rb")
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def ingest_job_id(album_url):
+    return "ingest:" + album_url
+
+
+def sweep_spool(spool_root, max_age):
+    """Remove what was spooled under ``spool_root`` over ``max_age`` seconds ago.
+
+    Every job removes its spool directory once it is over, older ones were
+    left by a job lost with its process or its queue. Parts of requests
+    that died while receiving them stay in ``incoming``. Returns the paths
+    removed.
+    """
+    deadline = time.time() - max_age
+    incoming = os.path.join(spool_root, "incoming")
+    removed = []
+    for root in (spool_root, incoming):
+        try:
+            names = os.listdir(root)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if path == incoming or os.stat(path).st_mtime > deadline:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                continue
+            removed.append(path)
+    return removed
+
+
+def spool_files(files, spool_dir):
+    """Save the uploaded files to ``spool_dir`` so a worker can pick them up."""
+    os.makedirs(spool_dir, exist_ok=True)
+    spooled = []
+    for index, file in enumerate(files):
+        path = os.path.join(spool_dir, "{:05d}".format(index))
+        if isinstance(file.stream, SpoolFile):
+            # Already on disk and hashed while it was received, just move it
+            file.stream.claim(path)
+            sha256, size = file.stream.sha256, file.stream.size
+        else:
+            file.save(path)
+            sha256, size = file_sha256(path), os.path.getsize(path)
+        spooled.append(
+            {
+                "path": path,
+                "filename": file.filename,
+                "mimetype": file.mimetype,
+                "sha256": sha256,
+                "size": size,
+            }
+        )
+    return spooled
+
+
+def variant_key(key, suffix):
+    return "{}_{}".format(key.rsplit(".", 1)[0], suffix)
+
+
+def build_blobs(spooled_files, unique_keys=False):
+    """Resize ``spooled_files`` and describe what storing them takes.
+
+    Returns ``(files, keys, blobs)``: the ``SpooledFile`` of every object to
+    upload, originals and resized copies, their keys and the new ``Blob``
+    rows. New photos are decoded once in a process pool to produce their
+    web sized copies and thumbnail, stored next to them.
+    """
+    derivatives = make_all_derivatives(
+        [spooled_file["path"] for spooled_file in spooled_files],
+        workers=current_app.config.get("DERIVATIVE_WORKERS"),
+    )
+    files, keys, blobs = [], [], []
+    for spooled_file, variants in zip(spooled_files, derivatives):
+        key = blob_key(spooled_file["sha256"], spooled_file["filename"], unique_keys)
+        files.append(
+            SpooledFile(
+                spooled_file["path"], spooled_file["filename"], spooled_file["mimetype"]
+            )
+        )
+        keys.append(key)
+        blob_variants = []
+        for variant in variants:
+            files.append(
+                SpooledFile(
+                    variant["path"], spooled_file["filename"], variant["mimetype"]
+                )
+            )
+            keys.append(variant_key(key, variant["suffix"]))
+            blob_variants.append(
+                {
+                    "key": keys[-1],
+                    "width": variant["width"],
+                    "height": variant["height"],
+                    "mimetype": variant["mimetype"],
+                    "thumbnail": variant["suffix"].startswith("thumb"),
+                }
+            )
+        blobs.append(
+            Blob(
+                spooled_file["sha256"],
+                key,
+                size=spooled_file["size"],
+                mimetype=spooled_file["mimetype"],
+                variants=blob_variants,
+            )
+        )
+    return files, keys, blobs
+
+
+def copy_blob(blob):
+    """A new ``Blob`` row for the objects of ``blob``, to insert it again."""
+    return Blob(
+        blob.sha256,
+        blob.key,
+        size=blob.size,
+        mimetype=blob.mimetype,
+        variants=blob.variants,
+    )
+
+
+def photo_progress(progress, spooled, existing, blobs):
+    """Report the ingestion of ``spooled`` photo by photo.
+
+    Photos of ``existing`` blobs are done right away, the others once every
+    object of their new blob is uploaded. Returns the ``on_result`` callback
+    of the uploads, called from their thread pool.
+    """
+    photos = Counter(spooled_file["sha256"] for spooled_file in spooled)
+    progress.set_total(len(spooled))
+    progress.advance(sum(photos[sha256] for sha256 in existing))
+    pending = {blob.sha256: len(blob.keys()) for blob in blobs}
+    owners = {key: blob.sha256 for blob in blobs for key in blob.keys()}
+    lock = threading.Lock()
+
+    def on_result(result):
+        sha256 = owners.get(result.key)
+        with lock:
+            if sha256 is None or result.error is not None:
+                return
+            pending[sha256] -= 1
+            if pending[sha256]:
+                return
+        progress.advance(photos[sha256])
+
+    return on_result
+
+
+@jobs.task("ingest_album")
+def ingest_album(payload, progress):
+    """Resize and store the new photos of an album and insert its images.
+
+    Photos are deduplicated by content: a digest already stored (in any
+    album, or twice in this upload) is neither resized nor uploaded again,
+    its image just references the existing blob.
+
+    Resizing and uploading take a while, an album deleted meanwhile can
+    release the last reference to a blob found at the start. Those blobs
+    are locked before their references are added, and the ones that
+    vanished are stored again under new keys, the objects of the old ones
+    being queued for deletion.
+    """
+    album = Album.query.get(payload["album_id"])
+    album_url = payload["album_url"]
+    spooled = payload["files"]
+    # First file of each digest, duplicates of stored photos included
+    unique = {}
+    for spooled_file in spooled:
+        unique.setdefault(spooled_file["sha256"], spooled_file)
+    unique = list(unique.values())
+    existing = find_blobs([spooled_file["sha256"] for spooled_file in unique])
+    metadata = dict(
+        zip(
+            [spooled_file["sha256"] for spooled_file in unique],
+            extract_all_metadata(
+                [spooled_file["path"] for spooled_file in unique],
+                workers=current_app.config.get("DERIVATIVE_WORKERS"),
+            ),
+        )
+    )
+    files, keys, blobs = build_blobs(
+        [
+            spooled_file
+            for spooled_file in unique
+            if spooled_file["sha256"] not in existing
+        ]
+    )
+
+    on_result = photo_progress(progress, spooled, existing, blobs)
+    results = []
+
+    def upload(files, keys):
+        uploaded = storage.upload_files(
+            album_url, files, on_result=on_result, keys=keys
+        )
+        results.extend(uploaded)
+        failed = [result for result in uploaded if result.error is not None]
+        if failed:
+            raise failed[0].error
+
+    try:
+        upload(files, keys)
+        for _ in range(INGEST_ATTEMPTS):
+            own = {blob.sha256 for blob in blobs}
+            reused = [f for f in unique if f["sha256"] not in own]
+            stored = {}
+            if reused:
+                stored = {
+                    blob.sha256: blob
+                    for blob in Blob.query.filter(
+                        Blob.sha256.in_([f["sha256"] for f in reused])
+                    ).with_for_update()
+                }
+            vanished = [f for f in reused if f["sha256"] not in stored]
+            if vanished:
+                more_files, more_keys, more_blobs = build_blobs(
+                    vanished, unique_keys=True
+                )
+                # Already counted, these photos are stored again silently
+                upload(more_files, more_keys)
+                blobs.extend(more_blobs)
+            for blob in blobs:
+                blob = add_blob(blob)
+                stored[blob.sha256] = blob
+            missing = acquire(Counter(stored[f["sha256"]].id for f in spooled))
+            if not missing:
+                break
+            # Deleted between the lock and the update, SQLite locks no row
+            db.session.rollback()
+            blobs = [copy_blob(blob) for blob in blobs]
+        else:
+            raise RuntimeError("The blobs of the album kept being deleted")
+
+        db.session.bulk_insert_mappings(
+            Image,
+            [
+                {
+                    "key": stored[spooled_file["sha256"]].key,
+                    "album_id": album.id,
+                    "viewed": False,
+                    "blob_id": stored[spooled_file["sha256"]].id,
+                    "variants": stored[spooled_file["sha256"]].variants,
+                    **metadata[spooled_file["sha256"]],
+                }
+                for spooled_file in spooled
+            ],
+        )
+        album.splice_new_images()
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        # Keep the objects of blobs committed meanwhile by another ingestion
+        kept = {
+            key
+            for blob in find_blobs([blob.sha256 for blob in blobs]).values()
+            for key in blob.keys()
+        }
+        storage.delete_keys(
+            [
+                result.key
+                for result in results
+                if result.error is None and result.key not in kept
+            ]
+        )
+        if album is not None:
+            album.delete()
+        raise
+    finally:
+        shutil.rmtree(payload["spool_dir"], ignore_errors=True)
+
+    # New albums get their first photo right away, not at the next rollover
+    roll_over(album_ids=[album.id])
+
+
+def is_photo_filename(filename):
+    return secure_filename(filename).rsplit(".", 1)[-1].lower() in PHOTO_MIMETYPES
+
+
+def presign_uploads(album_url, filenames):
+    """Presigned POST policies for browsers to upload ``filenames`` to S3.
+
+    Each file gets its own key under the album prefix, a content type
+    derived from its extension and the ``MAX_FILE_SIZE`` cap. Returns a list
+    of ``{"filename", "key", "url", "fields"}`` in the order of
+    ``filenames``.
+    """
+    prefix = storage.album_prefix(album_url)
+    max_size = current_app.config["MAX_FILE_SIZE"]
+    expires_in = current_app.config.get("DIRECT_UPLOAD_EXPIRES", 3600)
+    uploads = []
+    for filename in filenames:
+        key = make_key(filename, prefix)
+        content_type = PHOTO_MIMETYPES[key.rsplit(".", 1)[-1]]
+        post = storage.presigned_post(key, content_type, max_size, expires_in)
+        uploads.append(
+            {
+                "filename": filename,
+                "key": key,
+                "url": post["url"],
+                "fields": post["fields"],
+            }
+        )
+    return uploads
+
+
+def finalize_uploads(album, keys=None):
+    """Insert the images of the direct uploads that reached the album prefix.
+
+    The prefix is listed once rather than each object checked with a HEAD.
+    ``keys`` restricts the images to these keys, by default every object
+    under the prefix is taken. Keys already imported are skipped, so the
+    call can be retried. Returns ``(added, missing)``, the keys inserted and
+    the requested keys that never arrived or break the size limit.
+    """
+    max_size = current_app.config["MAX_FILE_SIZE"]
+    arrived = {
+        key: size
+        for key, size in storage.list_keys(storage.album_prefix(album.url)).items()
+        if 0 < size <= max_size
+    }
+    if keys is None:
+        keys = sorted(arrived)
+    known = {key for (key,) in album.images.with_entities(Image.key)}
+    added = [key for key in dict.fromkeys(keys) if key in arrived and key not in known]
+    missing = [key for key in keys if key not in arrived]
+    if added:
+        # Only the size is known, "storage backfill_metadata" reads the rest
+        db.session.bulk_insert_mappings(
+            Image,
+            [
+                {
+                    "key": key,
+                    "album_id": album.id,
+                    "viewed": False,
+                    "size": arrived[key],
+                }
+                for key in added
+            ],
+        )
+        album.splice_new_images()
+        db.session.commit()
+        response_cache.invalidate(album.url)
+        roll_over(album_ids=[album.id])
+    return added, missing
@@ -11,30 +11,56 @@ from flask import (
     flash,
     request,
     current_app,
+    jsonify,
 )
 from six.moves.urllib.parse import urlencode
-from werkzeug.utils import secure_filename
 from jose import jwt
-from urllib.request import urlopen
 
-import random
 import shutil
-import uuid
-import boto3
 
 
 import datetime
-import time
-import hashlib
 import sys
+import uuid
 
 from app.models import Album, Image
+from app.picker import current_pick
+from app.scheduler import pick_day, next_rollover
+from app.albums import (
+    list_albums,
+    delete_albums,
+    new_album,
+    find_album,
+    InvalidCursor,
+    PAGE_SIZE,
+)
+from app.main.ingest import (
+    spool_files,
+    sweep_spool,
+    ingest_job_id,
+    is_photo_filename,
+    presign_uploads,
+    finalize_uploads,
+)
 from app.main.forms import CreateAlbumForm, EditAlbumNameForm
-from app import db
+from app.metrics import timed, JWT_VERIFY_SECONDS
+from app.sessions import pretty_payload, regenerate_session
+from app.replicas import read_only
+from app.dbstats import pool_status
+from app import (
+    db,
+    jobs,
+    storage,
+    jwks_cache,
+    token_cache,
+    response_cache,
+    query_stats,
+    metrics,
+    photo_urls,
+    replicas,
+)
 from app.main import bp
 
-s3_resource = boto3.resource("s3", region_name="eu-west-1")
-
 ALGORITHMS = ["RS256"]
 
 
@@ -44,30 +70,6 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
-def create_bucket_name(bucket_prefix):
-    # The generated bucket name must be between 3 and 63 chars long
-    return "".join([bucket_prefix, str(uuid.uuid4())])
-
-
-def create_bucket(bucket_prefix, s3_connection):
-    session = boto3.session.Session(region_name="eu-west-1")
-    current_region = session.region_name
-    bucket_name = create_bucket_name(bucket_prefix)
-    bucket_response = s3_connection.create_bucket(
-        Bucket=bucket_name,
-        CreateBucketConfiguration={"LocationConstraint": current_region},
-    )
-    return bucket_name, bucket_response
-
-
-def delete_all_objects(bucket_name):
-    res = []
-    bucket = s3_resource.Bucket(bucket_name)
-    for obj_version in bucket.object_versions.all():
-        res.append({"Key": obj_version.object_key, "VersionId": obj_version.id})
-    bucket.delete_objects(Delete={"Objects": res})
-
-
 # Auth Header
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header
@@ -110,7 +112,7 @@ def get_token_auth_header():
     return token
 
 
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, permissions=None):
     if "permissions" not in payload:
         raise AuthError(
             {
@@ -120,34 +122,39 @@ def check_permissions(permission, payload):
             400,
         )
 
-    if permission not in payload["permissions"]:
+    if permissions is None:
+        permissions = frozenset(payload["permissions"])
+    if permission not in permissions:
         raise AuthError(
             {"code": "unauthorized", "description": "Permission not found."}, 403
         )
     return True
 
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(
+def get_jwks_url():
+    return current_app.config.get("JWKS_URL") or (
         f"https://{current_app.config.get('AUTH0_DOMAIN')}/.well-known/jwks.json"
     )
-    jwks = json.loads(jsonurl.read())
+
+
+@timed(JWT_VERIFY_SECONDS)
+def verify_decode_jwt(token):
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if "kid" not in unverified_header:
         raise AuthError(
             {"code": "invalid_header", "description": "Authorization malformed."}, 401
         )
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
+    try:
+        rsa_key = jwks_cache.get_key(unverified_header["kid"], get_jwks_url())
+    except Exception:
+        raise AuthError(
+            {
+                "code": "jwks_unavailable",
+                "description": "Unable to fetch the signing keys.",
+            },
+            503,
+        )
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -196,8 +203,11 @@ def requires_auth(permission=""):
         def wrapper(*args, **kwargs):
             try:
                 token = session["jwt_payload"]["access_token"]
-                payload = verify_decode_jwt(token)
-                check_permissions(permission, payload)
+                verified = token_cache.get(token)
+                if verified is None:
+                    verified = token_cache.put(token, verify_decode_jwt(token))
+                payload = verified.payload
+                check_permissions(permission, payload, verified.permissions)
             except BaseException:
                 abort(401)
 
@@ -208,13 +218,22 @@ def requires_auth(permission=""):
     return requires_auth_decorator
 
 
+@bp.before_app_first_request
+def sweep_lost_uploads():
+    sweep_spool(
+        current_app.config["INGEST_SPOOL_DIR"],
+        current_app.config.get("INGEST_SPOOL_MAX_AGE", 24 * 3600),
+    )
+
+
 @bp.route("/")
+@read_only
 def home():
     if "profile" in session:
         return render_template(
             "index.html",
             userinfo=session["profile"],
-            userinfo_pretty=json.dumps(session["jwt_payload"], indent=4),
+            userinfo_pretty=pretty_payload(),
             logged_in=True,
         )
     else:
@@ -227,7 +246,8 @@ def auth():
     token = current_app.auth0.authorize_access_token()
     userinfo = current_app.auth0.parse_id_token(token)
 
-    # Store the user information in flask session.
+    # Store the user information in the server side session, under a new id
+    regenerate_session()
     session["jwt_payload"] = token
     session["profile"] = {
         "user_id": userinfo["sub"],
@@ -265,41 +285,62 @@ def logout():
 
 @requires_auth("get:albums")
 @bp.route("/albums", methods=["GET"])
+@read_only
 def get_albums():
-    albums = Album.query.filter(
-        Album.user_id == session["profile"].get("user_id")
-    ).all()
-    albums = [album.format() for album in albums]
+    albums, next_cursor = get_albums_page()
     return render_template(
-        "my_albums.html", albums=albums, logged_in=True, userinfo=session["profile"]
+        "my_albums.html",
+        albums=albums,
+        next_cursor=next_cursor,
+        logged_in=True,
+        userinfo=session["profile"],
     )
 
 
+@bp.route("/api/albums", methods=["GET"])
+@read_only
+def api_get_albums():
+    albums, next_cursor = get_albums_page()
+    return jsonify({"albums": albums, "next_cursor": next_cursor})
+
+
+def get_albums_page():
+    """Page of the logged in user's albums selected by the query string."""
+    if "profile" not in session:
+        abort(401)
+    try:
+        return list_albums(
+            session["profile"].get("user_id"),
+            limit=request.args.get("limit", PAGE_SIZE, type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except InvalidCursor:
+        abort(400)
+
+
 @bp.route("/<album_id>", methods=["GET"])
+@read_only
 def get_album(album_id):
-    album = Album.query.filter(Album.url == album_id).first()
+    # Anonymous viewers all get the same page until the next pick.
+    anonymous = "profile" not in session and "_flashes" not in session
+    if anonymous:
+        cached = response_cache.get(album_id)
+        if cached is not None:
+            return response_cache.make_response(cached)
+
+    album = find_album(album_id)
     if not album:
         flash("Wrong album URL")
         abort(404)
 
-    if len(album.images.filter(Image.viewed == False).all()) == 0:
-        for image in album.images.all():
-            image.viewed = False
-        db.session.commit()
-
-    if (datetime.datetime.now() - album.last_time_viewed) > datetime.timedelta(
-        days=1
-    ) or album.last_photo_viewed is None:
-        files_list = [i.url for i in album.images.filter(Image.viewed == False).all()]
-        photo_picked = random.choice(files_list)
-        album.last_photo_viewed = photo_picked
-        album.last_time_viewed = datetime.datetime.now()
-        image = Image.query.filter(Image.url == photo_picked).first()
-        image.viewed = True
-
-        db.session.commit()
-    else:
-        photo_picked = album.last_photo_viewed
+    # Read only, the photos are picked ahead by the scheduler
+    now = datetime.datetime.now()
+    today = pick_day(now)
+    pick = current_pick(album.id, today)
+    if pick is None:
+        flash("This album has no photo")
+        abort(404)
+    image = pick.image
 
     if "profile" in session and album.user_id == session["profile"].get("user_id"):
         userinfo = session["profile"]
@@ -313,14 +354,35 @@ def get_album(album_id):
         userinfo = None
         can_manage = False
         logged_in = False
-    return render_template(
+    html = render_template(
         "album.html",
-        photo=photo_picked,
+        photo=image.original_url(),
+        image=image,
         userinfo=userinfo,
         can_manage=can_manage,
         logged_in=logged_in,
         album_title=album.name,
     )
+    if anonymous:
+        if pick.day == today:
+            expires_in = (next_rollover(now) - now).total_seconds()
+        else:
+            # Today's rollover hasn't reached this album yet
+            expires_in = 60
+        # The page must not outlive the signed urls it embeds
+        url_lifetime = photo_urls.lifetime()
+        if url_lifetime is not None:
+            expires_in = min(expires_in, url_lifetime)
+        expires_in = replicas.max_age(expires_in)
+        entry = response_cache.set(album_id, html, expires_in)
+        return response_cache.make_response(entry)
+    return html
+
+
+def current_user_id():
+    if "profile" in session:
+        return session["profile"].get("user_id")
+    return "ANON"
 
 
 @bp.route("/create", methods=["GET", "POST"])
@@ -342,43 +404,36 @@ def create_album():
             "create_album.html",
             form=form_album,
             success=False,
+            direct_upload_url=url_for("main.api_create_upload")
+            if hasattr(storage.backend, "presigned_post")
+            else None,
             logged_in=logged_in,
             userinfo=userinfo,
         )
     elif form_album.validate_on_submit():
         form_values = request.form
 
-        album_name = hashlib.md5(
-            "unicorn".encode("utf-8") + str(time.time()).encode("utf-8")
-        ).hexdigest()[:10]
-
+        spool_dir = os.path.join(
+            current_app.config["INGEST_SPOOL_DIR"], uuid.uuid4().hex
+        )
         try:
-            bucket_name, bucket_response = create_bucket(
-                bucket_prefix=album_name, s3_connection=s3_resource
+            # Only spool the files here, a job worker uploads them to S3
+            files = spool_files(
+                request.files.getlist(form_album.photo.name), spool_dir
+            )
+            album = new_album(form_values.get("name"), user_id)
+            album_name = album.url
+            jobs.enqueue(
+                "ingest_album",
+                {
+                    "album_id": album.id,
+                    "album_url": album_name,
+                    "spool_dir": spool_dir,
+                    "files": files,
+                },
+                job_id=ingest_job_id(album_name),
+                total=len(files),
             )
-            album = Album(name=form_values.get("name"), url=album_name, user_id=user_id)
-            db.session.add(album)
-            db.session.flush()
-            for filename in request.files.getlist(form_album.photo.name):
-                file_name = secure_filename(filename.filename)
-                name = hashlib.md5(
-                    "admin".encode("utf-8") + str(time.time()).encode("utf-8")
-                ).hexdigest()[:10]
-                file_name = f'{name}.{file_name.split(".")[-1]}'
-
-                s3_resource.Bucket(bucket_name).put_object(
-                    Body=filename,
-                    Key=file_name,
-                    ContentType=request.mimetype,
-                    ACL="public-read",
-                )
-
-                db_file_url = f"https://{bucket_name}.s3.amazonaws.com/{file_name}"
-
-                image = Image(url=db_file_url, album_id=album.id)
-                db.session.add(image)
-
-            db.session.commit()
 
             success = True
 
@@ -387,12 +442,7 @@ def create_album():
             error = True
             db.session.rollback()
             print(sys.exc_info())
-            delete_all_objects(bucket_name)
-            s3_resource.Bucket(bucket_name).delete()
-        except boto3.exception.ParamValidationError:
-            error = True
-            db.session.rollback()
-            print(sys.exc_info())
+            shutil.rmtree(spool_dir, ignore_errors=True)
         finally:
             db.session.close()
 
@@ -414,15 +464,109 @@ def create_album():
         "create_album.html",
         form=form_album,
         success=success,
+        progress_url=url_for("main.get_album_progress", album_id=album_name)
+        if success
+        else None,
         logged_in=logged_in,
         userinfo=userinfo,
     )
 
 
+@bp.route("/api/uploads", methods=["POST"])
+def api_create_upload():
+    """Create an album whose photos the browser uploads straight to S3.
+
+    Takes ``{"name": album name, "files": [file names]}`` and answers the
+    album url, the url to call once the uploads are done and a presigned
+    POST policy per file. Storages without browser uploads answer 404, the
+    page then posts the form to ``create_album`` instead.
+    """
+    if not hasattr(storage.backend, "presigned_post"):
+        abort(404)
+    data = request.get_json(silent=True) or {}
+    name = data.get("name")
+    filenames = data.get("files")
+    if not isinstance(name, str) or not name.strip() or len(name) > 50:
+        abort(400)
+    if (
+        not isinstance(filenames, list)
+        or not filenames
+        or len(filenames) > current_app.config.get("DIRECT_UPLOAD_MAX_FILES", 1000)
+        or not all(
+            isinstance(filename, str) and is_photo_filename(filename)
+            for filename in filenames
+        )
+    ):
+        abort(400)
+
+    album = new_album(name.strip(), current_user_id())
+    album_url = album.url
+    return jsonify(
+        {
+            "album": album_url,
+            "finalize_url": url_for("main.api_finalize_upload", album_id=album_url),
+            "uploads": presign_uploads(album_url, filenames),
+        }
+    )
+
+
+@bp.route("/api/uploads/<album_id>/finalize", methods=["POST"])
+def api_finalize_upload(album_id):
+    """Add the uploaded photos to the album, ``{"keys": [keys]}`` optional."""
+    album = find_album(album_id)
+    if not album or album.user_id != current_user_id():
+        abort(404)
+    keys = (request.get_json(silent=True) or {}).get("keys")
+    if keys is not None and not (
+        isinstance(keys, list) and all(isinstance(key, str) for key in keys)
+    ):
+        abort(400)
+    added, missing = finalize_uploads(album, keys)
+    return jsonify(
+        {
+            "album": album.url,
+            "url": url_for("main.get_album", album_id=album.url),
+            "added": len(added),
+            "missing": missing,
+        }
+    )
+
+
+@bp.route("/<album_id>/progress", methods=["GET"])
+def get_album_progress(album_id):
+    job = jobs.get(ingest_job_id(album_id))
+    if job is None:
+        album = find_album(album_id)
+        if not album:
+            abort(404)
+        total = album.images.count()
+        if jobs.durable and not total:
+            # Lost with the queue, e.g. the disk of a restarted instance
+            return jsonify(
+                {
+                    "state": "failed",
+                    "total": 0,
+                    "done": 0,
+                    "error": "The upload was lost",
+                }
+            )
+        # Pruned once finished, or queued in the memory of another process:
+        # whether it is over can't be told, only the photos inserted so far
+        return jsonify({"state": "unknown", "total": total, "done": total})
+    return jsonify(
+        {
+            "state": job["state"],
+            "total": job["total"],
+            "done": job["done"],
+            "error": job["error"],
+        }
+    )
+
+
 @requires_auth("patch:album")
 @bp.route("/<album_id>/edit", methods=["GET", "POST"])
 def edit_album_name(album_id):
-    album = Album.query.filter(Album.url == album_id).first()
+    album = find_album(album_id)
     if not album:
         flash("Wrong album URL")
         abort(404)
@@ -442,35 +586,85 @@ def edit_album_name(album_id):
             form_values = request.form
             album.name = form_values.get("name")
             album.update()
+            response_cache.invalidate(album.url)
             flash("Album name changed with success!")
             return redirect(url_for("main.get_album", album_id=album.url))
 
 
-@requires_auth("delete:album")
 @bp.route("/<album_id>/delete", methods=["DELETE"])
-def delete_album(album_id):
-    if "profile" in session:
-        album = Album.query.filter(Album.url == album_id).first()
-        if not album:
-            flash("Wrong album URL")
-            abort(404)
-        elif album.user_id != session["profile"].get("user_id"):
-            flash("You are not the owner of this album")
-            abort(401)
-        else:
-            album_name = album.name
-            try:
-                album.delete()
-                shutil.rmtree(
-                    os.path.join(
-                        current_app.config.get("UPLOADED_PHOTOS_DEST"), album_id
-                    )
-                )
-            except BaseException:
-                abort(500)
-            flash("Album {} deleted".format(album_name))
+@requires_auth("delete:album")
+def delete_album(payload, album_id):
+    if "profile" not in session:
+        abort(401)
+    album = find_album(album_id)
+    if not album:
+        flash("Wrong album URL")
+        abort(404)
+    elif album.user_id != session["profile"].get("user_id"):
+        flash("You are not the owner of this album")
+        abort(401)
+    album_name = album.name
+    delete_albums([album])
+    flash("Album {} deleted".format(album_name))
+    # 303 so that the client follows up with a GET, not another DELETE
+    return redirect(url_for("main.get_albums"), code=303)
+
+
+@bp.route("/api/albums", methods=["DELETE"])
+@requires_auth("delete:album")
+def api_delete_albums(payload):
+    """Delete several albums of the logged in user, ``{"albums": [urls]}``."""
+    if "profile" not in session:
+        abort(401)
+    album_urls = (request.get_json(silent=True) or {}).get("albums")
+    if not isinstance(album_urls, list) or not all(
+        isinstance(album_url, str) for album_url in album_urls
+    ):
+        abort(400)
+    albums = Album.query.filter(
+        Album.url.in_(album_urls),
+        Album.user_id == session["profile"].get("user_id"),
+    ).all()
+    deleted = [album.url for album in albums]
+    job_id = delete_albums(albums)
+    return jsonify(
+        {
+            "deleted": deleted,
+            "not_found": sorted(set(album_urls) - set(deleted)),
+            "job_id": job_id,
+        }
+    )
+
+
+@bp.route("/photos/<path:key>", methods=["GET"])
+def get_photo(key):
+    if not hasattr(storage.backend, "send"):
+        abort(404)
+    return storage.send(key)
+
+
+def check_metrics_token():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != "Bearer " + token:
+        abort(401)
+
+
+@bp.route("/metrics/queries", methods=["GET"])
+def get_query_metrics():
+    check_metrics_token()
+    return jsonify(
+        {
+            "endpoints": query_stats.snapshot(),
+            "pool": pool_status(db.engine),
+        }
+    )
+
 
-    return render_template("album.html", files_list=files_list)
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    check_metrics_token()
+    body, content_type = metrics.generate()
+    return body, 200, {"Content-Type": content_type}
 
 
 @requires_auth("")
@@ -0,0 +1,82 @@
+import base64
+import io
+import os
+
+from app.derivatives import map_in_pool
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # pragma: no cover
+    PILImage = None
+
+try:
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+except ImportError:  # pragma: no cover
+    pass
+
+# Bytes fetched to parse the header of a stored photo, EXIF included
+HEADER_BYTES = 64 * 1024
+PLACEHOLDER_SIZE = 16
+EXIF_ORIENTATION = 0x0112
+# Orientations turning the photo a quarter, width and height are swapped
+TRANSPOSED = (5, 6, 7, 8)
+
+
+def read_header(stream):
+    """``{"width", "height", "orientation"}`` of an image, as it is displayed.
+
+    Pillow only parses the header and EXIF when opening, no pixel is
+    decoded. Raises if the header can't be parsed, e.g. when ``stream``
+    holds the first bytes of a photo whose EXIF is larger.
+    """
+    with PILImage.open(stream) as image:
+        width, height = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION) or 1
+    if orientation in TRANSPOSED:
+        width, height = height, width
+    return {"width": width, "height": height, "orientation": orientation}
+
+
+def make_placeholder(stream):
+    """Blurry ``data:`` url of a few hundred bytes, shown until the photo loads.
+
+    JPEGs are decoded at 1/8 of their size at most with ``draft``, other
+    formats in full.
+    """
+    with PILImage.open(stream) as image:
+        image.draft("RGB", (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        tiny = ImageOps.exif_transpose(image).convert("RGB")
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buffer = io.BytesIO()
+    tiny.save(buffer, "JPEG", quality=40)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def extract_metadata(path):
+    """Metadata columns of the ``Image`` rows of the photo at ``path``.
+
+    Returns ``{"size"}`` alone if Pillow is missing or the file is not an
+    image it knows. Runs in a worker process, like ``make_derivatives``.
+    """
+    metadata = {"size": os.path.getsize(path)}
+    if PILImage is None:
+        return metadata
+    try:
+        with open(path, "rb") as f:
+            metadata.update(read_header(f))
+            f.seek(0)
+            metadata["placeholder"] = make_placeholder(f)
+    except Exception:
+        pass
+    return metadata
+
+
+def extract_all_metadata(paths, workers=None):
+    """Run ``extract_metadata`` for every path on the shared process pool."""
+    if not paths:
+        return []
+    if PILImage is None:
+        return [extract_metadata(path) for path in paths]
+    return map_in_pool(extract_metadata, paths, workers)
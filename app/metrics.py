@@ -0,0 +1,138 @@
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.dbstats import pool_status
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving a request",
+    ["endpoint", "method"],
+)
+REQUESTS = Counter("http_requests", "Requests served", ["endpoint", "method", "status"])
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL queries run by a request",
+    ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+S3_SECONDS = Histogram(
+    "s3_operation_duration_seconds", "Time spent in S3 API calls", ["operation"]
+)
+S3_OPERATIONS = Counter("s3_operations", "S3 API calls", ["operation", "outcome"])
+JWKS_FETCH_SECONDS = Histogram(
+    "jwks_fetch_duration_seconds", "Time spent fetching the JWKS", ["outcome"]
+)
+JWT_VERIFY_SECONDS = Histogram(
+    "jwt_verify_duration_seconds", "Time spent verifying access tokens", ["outcome"]
+)
+# Summed over the live worker processes
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections of the SQLAlchemy pool",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the duration of the block, labelled ``outcome`` ok or error.
+
+    Also usable as a function decorator.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - start)
+
+
+def _before_s3_call(model, context, **kwargs):
+    context["metrics_operation"] = model.name
+    context["metrics_start"] = time.perf_counter()
+
+
+def _observe_s3_call(context, outcome):
+    if "metrics_start" not in context:
+        return
+    operation = context["metrics_operation"]
+    S3_SECONDS.labels(operation).observe(time.perf_counter() - context["metrics_start"])
+    S3_OPERATIONS.labels(operation, outcome).inc()
+
+
+def _after_s3_call(http_response, context, **kwargs):
+    _observe_s3_call(context, "ok" if http_response.status_code < 300 else "error")
+
+
+def _after_s3_call_error(context, **kwargs):
+    _observe_s3_call(context, "error")
+
+
+def instrument_boto3(client):
+    """Count and time every API call made by the boto3 S3 ``client``."""
+    if client is None:
+        return
+    events = client.meta.events
+    events.register("before-call.s3", _before_s3_call)
+    events.register("after-call.s3", _after_s3_call)
+    events.register("after-call-error.s3", _after_s3_call_error)
+
+
+class Metrics(object):
+    """Prometheus metrics of the app, served by ``main.get_metrics``.
+
+    Under gunicorn every worker writes its samples to
+    ``PROMETHEUS_MULTIPROC_DIR`` (set up by ``gunicorn.conf.py``) and
+    ``generate`` merges them, so a scrape covers all the workers whichever
+    one answers it.
+    """
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._record)
+
+    @staticmethod
+    def _start():
+        g.request_start = time.perf_counter()
+
+    @staticmethod
+    def _record(response):
+        endpoint = request.endpoint or "unknown"
+        if "request_start" in g:
+            REQUEST_SECONDS.labels(endpoint, request.method).observe(
+                time.perf_counter() - g.request_start
+            )
+        REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+        REQUEST_QUERIES.labels(endpoint).observe(g.get("query_count", 0))
+
+        state = current_app.extensions.get("sqlalchemy")
+        if state is not None:
+            for name, value in pool_status(state.db.engine).items():
+                if name != "class":
+                    DB_POOL_CONNECTIONS.labels(name).set(value)
+        return response
+
+    @staticmethod
+    def generate():
+        """Return the text exposition of the metrics and its content type."""
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
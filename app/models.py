@@ -1,6 +1,8 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, LargeBinary
 from datetime import datetime
-from app import db
+import random
+import struct
+from app import db, photo_urls
 
 """
 db_drop_and_create_all()
@@ -14,6 +16,26 @@ def db_reset():
     db.create_all()
 
 
+def pack_cycle(image_ids):
+    return struct.pack("<%dI" % len(image_ids), *image_ids)
+
+
+def unpack_cycle(order):
+    order = order or b""
+    return list(struct.unpack("<%dI" % (len(order) // 4), order))
+
+
+def shuffle_cycle(image_ids, seed):
+    image_ids = list(image_ids)
+    random.Random(seed).shuffle(image_ids)
+    return image_ids
+
+
+def variant_url(variant):
+    # Variants written before keys only were stored carry their url
+    return photo_urls.url(variant["key"]) if "key" in variant else variant["url"]
+
+
 def setup_db(app, database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
@@ -23,14 +45,37 @@ def setup_db(app, database_path):
 
 
 class Album(db.Model):
+    # Serves the keyset pages of a user's albums, newest first
+    __table_args__ = (
+        db.Index("ix_album_user_id_timestamp", "user_id", "timestamp", "id"),
+    )
+
     id = Column(Integer, primary_key=True)
     name = Column(String(50), index=True, nullable=False)
-    url = Column(String(500), nullable=False)
+    url = Column(String(500), nullable=False, unique=True, index=True)
     timestamp = Column(DateTime, index=True, default=datetime.utcnow)
-    user_id = Column(String(50))
+    user_id = Column(String(50), index=True)
     last_time_viewed = Column(DateTime, default=datetime.utcnow)
-    last_photo_viewed = Column(String(300))
-    images = db.relationship("Image", backref="album", lazy="dynamic")
+    last_photo_viewed_id = Column(
+        Integer,
+        db.ForeignKey("image.id", use_alter=True, name="fk_album_last_photo_viewed_id"),
+    )
+    # Shuffled image ids of the current cycle, packed as little-endian uint32
+    cycle_order = Column(LargeBinary)
+    cycle_position = Column(Integer, default=0, server_default="0", nullable=False)
+    cycle_seed = Column(Integer)
+    # Images are deleted with their album by the database
+    images = db.relationship(
+        "Image",
+        backref="album",
+        lazy="dynamic",
+        foreign_keys="Image.album_id",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    last_photo_viewed = db.relationship(
+        "Image", foreign_keys=[last_photo_viewed_id], post_update=True
+    )
 
     def __repr__(self):
         return "<Album {} {} {} {} {}>".format(
@@ -38,13 +83,47 @@ class Album(db.Model):
             self.url,
             self.user_id,
             self.last_time_viewed,
-            self.last_photo_viewed,
+            self.last_photo_viewed_id,
         )
 
     def __init__(self, name, url, user_id="ANON"):
         self.name = name
         self.url = url
         self.user_id = user_id
+        self.cycle_position = 0
+
+    def get_cycle(self):
+        return unpack_cycle(self.cycle_order)
+
+    def set_cycle(self, image_ids, position=0):
+        self.cycle_order = pack_cycle(image_ids)
+        self.cycle_position = position
+
+    def splice_images(self, image_ids, rng=random):
+        """Insert new images at random places among the not yet shown ones."""
+        if self.cycle_order is None:
+            return
+        order = self.get_cycle()
+        position = self.cycle_position or 0
+        for image_id in image_ids:
+            order.insert(rng.randint(position, len(order)), image_id)
+        self.set_cycle(order, position)
+
+    def splice_new_images(self, rng=random):
+        """Splice the images of the album missing from its running cycle.
+
+        Called once new images are inserted, so they can be picked before
+        the cycle ends. The row is locked first, the scheduler moves the
+        cursor of the same row.
+        """
+        db.session.refresh(self, with_for_update=True)
+        if self.cycle_order is None:
+            return
+        in_cycle = set(self.get_cycle())
+        image_ids = self.images.with_entities(Image.id).order_by(Image.id)
+        self.splice_images(
+            [image_id for (image_id,) in image_ids if image_id not in in_cycle], rng
+        )
 
     def insert(self):
         db.session.add(self)
@@ -64,24 +143,78 @@ class Album(db.Model):
             "url": self.url,
             "timestamp": self.timestamp,
             "user_id": self.user_id,
-            "images": self.images,
         }
 
 
 class Image(db.Model):
+    # Serves the "unviewed images of an album" lookups
+    __table_args__ = (db.Index("ix_image_album_id_viewed", "album_id", "viewed"),)
+
     id = Column(Integer, primary_key=True)
-    url = Column(String(300), nullable=False)
+    # Storage key of the photo, its urls are built by app.urls.PhotoUrls
+    key = Column(String(300))
+    # Absolute url of photos still in a bucket-per-album bucket, without key
+    url = Column(String(300))
     timestamp = Column(DateTime, index=True, default=datetime.utcnow)
     viewed = Column(Boolean)
-    album_id = Column(Integer, db.ForeignKey("album.id"), nullable=False)
+    album_id = Column(
+        Integer,
+        db.ForeignKey("album.id", ondelete="CASCADE", name="fk_image_album_id_album"),
+        nullable=False,
+    )
+    blob_id = Column(Integer, db.ForeignKey("blob.id"))
+    # Resized copies made at ingestion: [{key, width, height, mimetype, thumbnail}]
+    variants = Column(db.JSON)
+    # Read from the header at ingestion, width and height as displayed
+    width = Column(Integer)
+    height = Column(Integer)
+    # EXIF orientation, 1 to 8
+    orientation = Column(db.SmallInteger)
+    size = Column(Integer)
+    # data: url of a tiny blurry copy, shown while the photo loads
+    placeholder = Column(db.Text)
 
     def __repr__(self):
-        return "<Image {} {} {}>".format(self.album_id, self.url, self.viewed)
+        return "<Image {} {} {}>".format(
+            self.album_id, self.key or self.url, self.viewed
+        )
 
-    def __init__(self, url, album_id, viewed=False):
-        self.url = url
+    def __init__(
+        self, key, album_id, viewed=False, variants=None, blob_id=None, url=None
+    ):
+        self.key = key
         self.album_id = album_id
         self.viewed = viewed
+        self.variants = variants
+        self.blob_id = blob_id
+        self.url = url
+
+    def original_url(self):
+        return photo_urls.url(self.key) if self.key else self.url
+
+    def srcset(self, mimetype):
+        return ", ".join(
+            "{} {}w".format(variant_url(variant), variant["width"])
+            for variant in self.variants or []
+            if variant["mimetype"] == mimetype and not variant["thumbnail"]
+        )
+
+    def display_url(self):
+        """Largest JPEG copy, which unlike HEIC originals every browser shows."""
+        jpegs = [
+            variant
+            for variant in self.variants or []
+            if variant["mimetype"] == "image/jpeg" and not variant["thumbnail"]
+        ]
+        if not jpegs:
+            return self.original_url()
+        return variant_url(max(jpegs, key=lambda variant: variant["width"]))
+
+    def thumbnail_url(self):
+        for variant in self.variants or []:
+            if variant["thumbnail"]:
+                return variant_url(variant)
+        return self.original_url()
 
     def insert(self):
         db.session.add(self)
@@ -97,8 +230,93 @@ class Image(db.Model):
     def format(self):
         return {
             "id": self.id,
+            "key": self.key,
             "url": self.url,
             "timestamp": self.timestamp,
             "album_id": self.album_id,
             "viewed": self.viewed,
+            "variants": self.variants,
+            "blob_id": self.blob_id,
+            "width": self.width,
+            "height": self.height,
+            "orientation": self.orientation,
+            "size": self.size,
+            "placeholder": self.placeholder,
+        }
+
+
+class Blob(db.Model):
+    """A stored photo, shared by every image with the same content."""
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    key = Column(String(300), nullable=False)
+    size = Column(Integer)
+    mimetype = Column(String(100))
+    # Number of Image rows pointing to this blob
+    refcount = Column(Integer, default=0, server_default="0", nullable=False)
+    # Resized copies: [{key, width, height, mimetype, thumbnail}]
+    variants = Column(db.JSON)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    images = db.relationship("Image", backref="blob", lazy="dynamic")
+
+    def __repr__(self):
+        return "<Blob {} {} {}>".format(self.sha256, self.key, self.refcount)
+
+    def __init__(self, sha256, key, size=None, mimetype=None, variants=None):
+        self.sha256 = sha256
+        self.key = key
+        self.size = size
+        self.mimetype = mimetype
+        self.variants = variants
+        self.refcount = 0
+
+    def keys(self):
+        """Every stored object of the blob, the original and its copies."""
+        return [self.key] + [variant["key"] for variant in self.variants or []]
+
+    def format(self):
+        return {
+            "id": self.id,
+            "sha256": self.sha256,
+            "key": self.key,
+            "size": self.size,
+            "mimetype": self.mimetype,
+            "refcount": self.refcount,
+            "variants": self.variants,
+        }
+
+
+class DailyPick(db.Model):
+    """Photo of the day of an album, written ahead by the pick scheduler."""
+
+    __tablename__ = "daily_pick"
+
+    album_id = Column(
+        Integer,
+        db.ForeignKey(
+            "album.id", ondelete="CASCADE", name="fk_daily_pick_album_id_album"
+        ),
+        primary_key=True,
+    )
+    day = Column(db.Date, primary_key=True)
+    image_id = Column(
+        Integer,
+        db.ForeignKey(
+            "image.id", ondelete="CASCADE", name="fk_daily_pick_image_id_image"
+        ),
+        nullable=False,
+    )
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    image = db.relationship("Image")
+
+    def __repr__(self):
+        return "<DailyPick {} {} {}>".format(self.album_id, self.day, self.image_id)
+
+    def format(self):
+        return {
+            "album_id": self.album_id,
+            "day": self.day,
+            "image_id": self.image_id,
+            "timestamp": self.timestamp,
         }
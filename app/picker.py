@@ -0,0 +1,177 @@
+import datetime
+import random
+import struct
+
+from sqlalchemy import bindparam, func
+
+from app import db
+from app.models import Album, Image, DailyPick, pack_cycle, unpack_cycle, shuffle_cycle
+
+
+def cycle_cursors(album_ids):
+    """``(id, url, position, length, image id under the cursor)`` of albums.
+
+    The image id is sliced out of the packed cycle by the database, so the
+    whole permutation is only transferred when a cycle has to be rebuilt.
+    The rows stay locked until the caller commits: ``splice_new_images``
+    rewrites the cycle of albums whose cursor is being moved.
+    """
+    rows = (
+        db.session.query(
+            Album.id,
+            Album.url,
+            Album.cycle_position,
+            func.length(Album.cycle_order),
+            func.substr(Album.cycle_order, Album.cycle_position * 4 + 1, 4),
+        )
+        .filter(Album.id.in_(album_ids))
+        .order_by(Album.id)
+        .with_for_update()
+        .all()
+    )
+    cursors = []
+    for album_id, url, position, length, head in rows:
+        head = bytes(head) if head is not None else b""
+        image_id = struct.unpack("<I", head)[0] if len(head) == 4 else None
+        cursors.append((album_id, url, position or 0, (length or 0) // 4, image_id))
+    return cursors
+
+
+def _rebuild_pick(album_id, rng):
+    """Walk or reshuffle the cycle of an album whose cursor image is unusable.
+
+    Returns ``(image_id, position, cycle_order, cycle_seed)``, the last two
+    being ``None`` unless a new cycle was shuffled, or ``None`` if the album
+    has no image.
+    """
+    album_images = {
+        image_id
+        for (image_id,) in db.session.query(Image.id).filter(Image.album_id == album_id)
+    }
+    if not album_images:
+        return None
+    order, position = (
+        db.session.query(Album.cycle_order, Album.cycle_position)
+        .filter(Album.id == album_id)
+        .one()
+    )
+    order = unpack_cycle(order)
+    position = position or 0
+    # Skip the ids of deleted images, they stay in the cycle
+    while position < len(order):
+        if order[position] in album_images:
+            return order[position], position + 1, None, None
+        position += 1
+
+    seed = rng.getrandbits(31)
+    order = shuffle_cycle(sorted(album_images), seed)
+    return order[0], 1, pack_cycle(order), seed
+
+
+def plan_picks(album_ids, rng=random):
+    """Choose the next image of each album, without writing anything.
+
+    Usually one query for the whole batch: the image under each cursor is
+    checked with a single ``IN``. Albums at the end of their cycle or whose
+    next image was deleted are rebuilt one by one. Returns a list of dicts
+    with ``album_id``, ``album_url``, ``image_id``, ``position`` and, for
+    reshuffled albums, ``cycle_order`` and ``cycle_seed``.
+    """
+    cursors = cycle_cursors(album_ids)
+    candidates = {image_id for _, _, _, _, image_id in cursors if image_id}
+    existing = set()
+    if candidates:
+        existing = set(
+            db.session.query(Image.id, Image.album_id).filter(Image.id.in_(candidates))
+        )
+
+    plans = []
+    for album_id, url, position, length, image_id in cursors:
+        plan = {"album_id": album_id, "album_url": url}
+        if position < length and (image_id, album_id) in existing:
+            plan.update(image_id=image_id, position=position + 1)
+        else:
+            rebuilt = _rebuild_pick(album_id, rng)
+            if rebuilt is None:
+                continue
+            image_id, position, order, seed = rebuilt
+            plan.update(image_id=image_id, position=position)
+            if order is not None:
+                plan.update(cycle_order=order, cycle_seed=seed)
+        plans.append(plan)
+    return plans
+
+
+def apply_picks(plans, day, now=None):
+    """Write planned picks with one statement per kind of change.
+
+    Album cursors are moved with a single executemany UPDATE, reshuffled
+    cycles with another, viewed flags with two set based UPDATEs and the
+    ``daily_pick`` rows with one INSERT. The caller commits.
+    """
+    if not plans:
+        return
+    now = now or datetime.datetime.now()
+    albums = Album.__table__
+    db.session.execute(
+        albums.update()
+        .where(albums.c.id == bindparam("album_id"))
+        .values(
+            cycle_position=bindparam("position"),
+            last_photo_viewed_id=bindparam("image_id"),
+            last_time_viewed=now,
+        ),
+        [
+            {
+                "album_id": plan["album_id"],
+                "position": plan["position"],
+                "image_id": plan["image_id"],
+            }
+            for plan in plans
+        ],
+    )
+
+    reshuffled = [plan for plan in plans if "cycle_order" in plan]
+    if reshuffled:
+        db.session.execute(
+            albums.update()
+            .where(albums.c.id == bindparam("album_id"))
+            .values(cycle_order=bindparam("order"), cycle_seed=bindparam("seed")),
+            [
+                {
+                    "album_id": plan["album_id"],
+                    "order": plan["cycle_order"],
+                    "seed": plan["cycle_seed"],
+                }
+                for plan in reshuffled
+            ],
+        )
+        Image.query.filter(
+            Image.album_id.in_([plan["album_id"] for plan in reshuffled])
+        ).update({Image.viewed: False}, synchronize_session=False)
+
+    Image.query.filter(Image.id.in_([plan["image_id"] for plan in plans])).update(
+        {Image.viewed: True}, synchronize_session=False
+    )
+    db.session.execute(
+        DailyPick.__table__.insert(),
+        [
+            {
+                "album_id": plan["album_id"],
+                "day": day,
+                "image_id": plan["image_id"],
+                "timestamp": now,
+            }
+            for plan in plans
+        ],
+    )
+
+
+def current_pick(album_id, day):
+    """Latest ``DailyPick`` of the album up to ``day``, with its image."""
+    return (
+        DailyPick.query.options(db.joinedload(DailyPick.image))
+        .filter(DailyPick.album_id == album_id, DailyPick.day <= day)
+        .order_by(DailyPick.day.desc())
+        .first()
+    )
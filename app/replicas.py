@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+
+# Flask session key, reads stay on the primary until this timestamp
+PRIMARY_UNTIL = "_primary_until"
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of ``read_only`` views to a read replica.
+
+    Flushes, INSERT/UPDATE/DELETE statements, ``SELECT ... FOR UPDATE`` and
+    every query after the first write of the session go to the primary.
+    """
+
+    def __init__(self, db, **options):
+        self._db = db
+        self._wrote = False
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if (
+            self._flushing
+            or isinstance(clause, UpdateBase)
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            self._wrote = True
+            if has_app_context():
+                g.db_wrote = True
+        elif not self._wrote:
+            router = self.app.extensions.get("replicas")
+            bind_key = router.choose() if router is not None else None
+            if bind_key is not None:
+                g.replica_read = True
+                return self._db.get_engine(self.app, bind=bind_key)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(view):
+    """Let the queries of ``view`` go to a read replica."""
+
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+
+    return decorated
+
+
+class ReplicaRouter(object):
+    """Flask extension choosing the read replica of each query.
+
+    Replicas are the ``SQLALCHEMY_BINDS`` listed in ``REPLICA_BINDS``. One
+    is picked at random among those whose lag, checked at most every
+    ``REPLICA_LAG_CHECK_INTERVAL`` seconds, is under ``REPLICA_MAX_LAG``
+    seconds, the primary being used when none is. A request that wrote
+    keeps the reads of its client on the primary for
+    ``REPLICA_STICKY_SECONDS``, so users see their own changes.
+    """
+
+    def __init__(self, db=None):
+        self.db = db
+        self.binds = []
+        self.max_lag = 5.0
+        self.check_interval = 1.0
+        self.sticky_seconds = 10.0
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.binds = list(app.config.get("REPLICA_BINDS") or [])
+        self.max_lag = app.config.get("REPLICA_MAX_LAG", 5.0)
+        self.check_interval = app.config.get("REPLICA_LAG_CHECK_INTERVAL", 1.0)
+        self.sticky_seconds = app.config.get("REPLICA_STICKY_SECONDS", 10.0)
+        self._health = {}
+        app.extensions["replicas"] = self
+        app.after_request(self._stick_to_primary)
+
+    def choose(self):
+        """Bind key of a replica for the current query, ``None`` for the primary."""
+        if not self.binds or not has_request_context():
+            return None
+        if not g.get("replica_reads") or g.get("db_wrote"):
+            return None
+        if session.get(PRIMARY_UNTIL, 0) > time.time():
+            return None
+        healthy = [bind_key for bind_key in self.binds if self.healthy(bind_key)]
+        return random.choice(healthy) if healthy else None
+
+    def healthy(self, bind_key):
+        now = time.monotonic()
+        checked_at, healthy = self._health.get(bind_key, (None, False))
+        if checked_at is not None and now - checked_at < self.check_interval:
+            return healthy
+        with self._lock:
+            checked_at, healthy = self._health.get(bind_key, (None, False))
+            if checked_at is None or now - checked_at >= self.check_interval:
+                try:
+                    healthy = self.lag(bind_key) <= self.max_lag
+                except Exception as e:
+                    self.app.logger.warning("Replica %s unavailable: %s", bind_key, e)
+                    healthy = False
+                self._health[bind_key] = (now, healthy)
+        return healthy
+
+    def lag(self, bind_key):
+        """Seconds the replica ``bind_key`` is behind the primary."""
+        engine = self.db.get_engine(self.app, bind=bind_key)
+        if engine.dialect.name != "postgresql":
+            # Only PostgreSQL reports its replay position
+            return 0.0
+        with engine.connect() as connection:
+            # Caught up replicas report no lag however long the primary idled
+            lag = connection.scalar(
+                "SELECT CASE WHEN NOT pg_is_in_recovery() "
+                "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+                "END"
+            )
+        # No transaction replayed yet
+        return float("inf") if lag is None else float(lag)
+
+    def max_age(self, seconds):
+        """Cap ``seconds`` a response of this request can be cached.
+
+        A page read from a replica may miss writes of the last ``max_lag``
+        seconds, invalidated meanwhile, it is only kept that long.
+        """
+        if has_request_context() and g.get("replica_read"):
+            return min(seconds, self.max_lag)
+        return seconds
+
+    def _stick_to_primary(self, response):
+        if self.binds and g.get("db_wrote"):
+            session[PRIMARY_UNTIL] = time.time() + self.sticky_seconds
+        return response
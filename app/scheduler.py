@@ -0,0 +1,93 @@
+import datetime
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import and_, exists
+from sqlalchemy.exc import IntegrityError
+
+from app import db, response_cache
+from app.models import Album, DailyPick
+from app.picker import plan_picks, apply_picks
+
+
+def rollover_time():
+    """Time of day of the rollover, from ``DAILY_PICK_TIME`` ("HH:MM")."""
+    hour, minute = current_app.config.get("DAILY_PICK_TIME", "00:00").split(":")
+    return datetime.time(int(hour), int(minute))
+
+
+def last_rollover(now=None):
+    """The most recent rollover moment, at or before ``now``."""
+    now = now or datetime.datetime.now()
+    rollover = datetime.datetime.combine(now.date(), rollover_time())
+    if rollover > now:
+        rollover -= datetime.timedelta(days=1)
+    return rollover
+
+
+def next_rollover(now=None):
+    return last_rollover(now) + datetime.timedelta(days=1)
+
+
+def pick_day(now=None):
+    """The day whose photo should be shown at ``now``."""
+    return last_rollover(now).date()
+
+
+def roll_over(day=None, batch_size=500, album_ids=None, rng=random):
+    """Pick the photo of ``day`` of every album that has none yet.
+
+    Albums are taken ``batch_size`` at a time in id order, each batch being
+    planned with a couple of queries, written with a handful of set based
+    statements and committed. When another scheduler wrote some albums of
+    a batch first, the batch is queried again without them. Returns the
+    number of albums picked.
+    """
+    day = day or pick_day()
+    has_pick = exists().where(
+        and_(DailyPick.album_id == Album.id, DailyPick.day == day)
+    )
+    picked = 0
+    after = 0
+    failed = None
+    while True:
+        query = db.session.query(Album.id).filter(Album.id > after, ~has_pick)
+        if album_ids is not None:
+            query = query.filter(Album.id.in_(album_ids))
+        batch = [album_id for (album_id,) in query.order_by(Album.id).limit(batch_size)]
+        if not batch:
+            break
+
+        plans = plan_picks(batch, rng)
+        try:
+            apply_picks(plans, day)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if batch == failed:
+                # Not a pick written meanwhile, ~has_pick can't filter it out
+                raise
+            failed = batch
+            continue
+        after = batch[-1]
+        picked += len(plans)
+        for plan in plans:
+            response_cache.invalidate(plan["album_url"])
+    return picked
+
+
+def run_scheduler(batch_size=500, once=False):
+    """Roll over at every ``DAILY_PICK_TIME``, catching up a missed one first."""
+    while True:
+        started = time.monotonic()
+        picked = roll_over(batch_size=batch_size)
+        print(
+            "Picked the photo of {} for {} albums in {:.1f}s".format(
+                pick_day(), picked, time.monotonic() - started
+            )
+        )
+        if once:
+            return picked
+        delay = (next_rollover() - datetime.datetime.now()).total_seconds()
+        time.sleep(max(delay, 0) + 1)
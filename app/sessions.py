@@ -0,0 +1,189 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+from app.cache import MemoryBackend, RedisBackend
+
+
+class SQLiteSessionStore(object):
+    """Sessions in a SQLite file shared by every worker process of the host."""
+
+    # Expired sessions are purged once every this many writes
+    PURGE_INTERVAL = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_expires_at "
+                "ON sessions (expires_at)"
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    def set(self, key, value, timeout):
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + timeout),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_INTERVAL == 0:
+            connection.execute(
+                "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+            )
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (key,))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a new id, to be called when the user logs in."""
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Session data kept in ``store``, the cookie only holds a random id.
+
+    Anonymous visitors with an empty session get no cookie and cost no
+    store access. Unknown or expired ids are never reused, a new id is
+    issued instead.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+                except ValueError:
+                    pass
+        return ServerSideSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    app.session_cookie_name, domain=domain, path=path
+                )
+            return
+
+        if self.should_set_cookie(app, session):
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), lifetime)
+            response.set_cookie(
+                app.session_cookie_name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+class ServerSideSessions(object):
+    """Flask extension replacing the cookie session by a server side one.
+
+    ``SESSION_TYPE`` picks the store: "cookie" (the default) keeps Flask's
+    signed cookie session, "redis" (``SESSION_REDIS_URL``, shared by every
+    instance), "sqlite" (``SESSION_PATH``, shared by the workers of a host
+    only) or "memory" (per process, for tests).
+    """
+
+    def init_app(self, app, store=None):
+        if store is None:
+            session_type = app.config.get("SESSION_TYPE", "cookie")
+            if session_type == "cookie":
+                return
+            elif session_type == "sqlite":
+                store = SQLiteSessionStore(app.config["SESSION_PATH"])
+            elif session_type == "redis":
+                store = RedisBackend(
+                    app.config.get("SESSION_REDIS_URL"), prefix="1pic1day:session:"
+                )
+            elif session_type == "memory":
+                store = MemoryBackend(max_entries=100000)
+            else:
+                raise ValueError("Unknown SESSION_TYPE {}".format(session_type))
+        app.session_interface = ServerSideSessionInterface(store)
+
+
+class LazyJSON(object):
+    """Indented JSON of ``getter()``, only computed if rendered."""
+
+    def __init__(self, getter):
+        self.getter = getter
+
+    def __str__(self):
+        return json.dumps(self.getter(), indent=4)
+
+
+def regenerate_session():
+    """Give the current session a new id, cookie sessions have none."""
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+
+def pretty_payload():
+    return LazyJSON(lambda: session.get("jwt_payload"))
@@ -0,0 +1,53 @@
+import hashlib
+import hmac
+import string
+
+from flask import current_app
+
+ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+# 62 ** 6 covers every 32 bit value. Legacy md5 slugs are 10 characters
+# long, so the two kinds never overlap.
+SLUG_LENGTH = 6
+ROUNDS = 4
+
+
+def _key():
+    key = current_app.config.get("SLUG_KEY") or current_app.config["SECRET_KEY"]
+    return key.encode("utf-8")
+
+
+def _round(key, index, half):
+    digest = hmac.new(key, bytes([index]) + half.to_bytes(2, "big"), hashlib.sha256)
+    return int.from_bytes(digest.digest()[:2], "big")
+
+
+def _permute(value, key, rounds):
+    """Feistel network over 32 bit values, a bijection for any key."""
+    left, right = value >> 16, value & 0xFFFF
+    for index in rounds:
+        left, right = right, left ^ _round(key, index, right)
+    return right << 16 | left
+
+
+def encode_slug(album_id):
+    """Short url of the album ``album_id``, distinct for every id by construction."""
+    if not 0 <= album_id < 1 << 32:
+        raise ValueError("Album id out of range: {}".format(album_id))
+    value = _permute(album_id, _key(), range(ROUNDS))
+    chars = []
+    for _ in range(SLUG_LENGTH):
+        value, digit = divmod(value, 62)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode_slug(slug):
+    """Album id of a slug made by ``encode_slug``, ``None`` for other strings."""
+    if len(slug) != SLUG_LENGTH or not all(char in ALPHABET for char in slug):
+        return None
+    value = 0
+    for char in slug:
+        value = value * 62 + ALPHABET.index(char)
+    if value >= 1 << 32:
+        return None
+    return _permute(value, _key(), reversed(range(ROUNDS)))
@@ -0,0 +1,381 @@
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlparse
+
+import boto3
+from flask import send_from_directory
+
+from app.uploads import (
+    upload_files,
+    make_key,
+    UploadResult,
+    DELETE_BATCH_SIZE,
+    CACHE_CONTROL,
+)
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+def presign_get(url, region, credentials, signed_at, expires_in):
+    """Query string signed (AWS Signature Version 4) GET of the object at ``url``.
+
+    Unlike ``generate_presigned_url``, which signs at the current time, the
+    signature only depends on its arguments: ``signed_at`` (epoch seconds)
+    is the ``X-Amz-Date`` and ``expires_in`` counts from it. ``credentials``
+    are frozen botocore credentials.
+    """
+    parsed = urlparse(url)
+    timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(signed_at))
+    scope = "{}/{}/s3/aws4_request".format(timestamp[:8], region)
+    query = {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": "{}/{}".format(credentials.access_key, scope),
+        "X-Amz-Date": timestamp,
+        "X-Amz-Expires": str(int(expires_in)),
+        "X-Amz-SignedHeaders": "host",
+    }
+    if credentials.token:
+        query["X-Amz-Security-Token"] = credentials.token
+    query = "&".join(
+        "{}={}".format(quote(name, safe="-_.~"), quote(value, safe="-_.~"))
+        for name, value in sorted(query.items())
+    )
+    path = quote(parsed.path, safe="/-_.~")
+    canonical_request = "\n".join(
+        ["GET", path, query, "host:" + parsed.netloc, "", "host", "UNSIGNED-PAYLOAD"]
+    )
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            timestamp,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ]
+    )
+    key = ("AWS4" + credentials.secret_key).encode("utf-8")
+    for part in (timestamp[:8], region, "s3", "aws4_request"):
+        key = _hmac(key, part)
+    signature = _hmac(key, string_to_sign).hex()
+    return "{}://{}{}?{}&X-Amz-Signature={}".format(
+        parsed.scheme, parsed.netloc, path, query, signature
+    )
+
+
+class S3Storage(object):
+    """Every album in one bucket, under its own ``albums/<album url>/`` prefix."""
+
+    def __init__(
+        self,
+        bucket,
+        region="eu-west-1",
+        acl=None,
+        upload_workers=8,
+        multipart_threshold=8 * 1024 * 1024,
+        delete_workers=4,
+        endpoint_url=None,
+    ):
+        self.bucket = bucket
+        self.region = region
+        self.acl = acl
+        self.upload_workers = upload_workers
+        self.multipart_threshold = multipart_threshold
+        self.delete_workers = delete_workers
+        self.endpoint_url = endpoint_url
+        session = boto3.Session()
+        self.resource = session.resource(
+            "s3", region_name=region, endpoint_url=endpoint_url
+        )
+        # Clients are thread safe, resources are not
+        self.client = self.resource.meta.client
+        # Shared with the client, refreshed by botocore when they expire
+        self.credentials = session.get_credentials()
+
+    @staticmethod
+    def album_prefix(album_url):
+        return "albums/{}/".format(album_url)
+
+    def url(self, key):
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def key_from_url(self, url):
+        """Return ``(bucket, key)`` of an object url written by this app."""
+        parsed = urlparse(url)
+        return parsed.netloc.split(".s3.amazonaws.com")[0], parsed.path.lstrip("/")
+
+    def upload_files(self, album_url, files, on_result=None, keys=None):
+        return upload_files(
+            self.client,
+            self.bucket,
+            files,
+            key_prefix=self.album_prefix(album_url),
+            max_workers=self.upload_workers,
+            multipart_threshold=self.multipart_threshold,
+            acl=self.acl,
+            on_result=on_result,
+            keys=keys,
+        )
+
+    def presigned_url(self, key, expires_in, signed_at=None):
+        """Signed url of ``key``, valid ``expires_in`` seconds from ``signed_at``.
+
+        The same arguments give the same url in every process.
+        """
+        if self.endpoint_url:
+            url = "{}/{}/{}".format(self.endpoint_url.rstrip("/"), self.bucket, key)
+        else:
+            url = "https://{}.s3.{}.amazonaws.com/{}".format(
+                self.bucket, self.region, key
+            )
+        return presign_get(
+            url,
+            self.region,
+            self.credentials.get_frozen_credentials(),
+            time.time() if signed_at is None else signed_at,
+            expires_in,
+        )
+
+    def presigned_post(self, key, content_type, max_size, expires_in=3600):
+        """Policy letting a browser POST one file of ``content_type`` to ``key``.
+
+        S3 refuses the upload if the form declares another content type or
+        the file is empty or larger than ``max_size`` bytes. Returns the
+        ``{"url", "fields"}`` of the form, the file goes in a last ``file``
+        field.
+        """
+        fields = {"Content-Type": content_type, "Cache-Control": CACHE_CONTROL}
+        conditions = [
+            {"Content-Type": content_type},
+            {"Cache-Control": CACHE_CONTROL},
+            ["content-length-range", 1, max_size],
+        ]
+        if self.acl:
+            fields["acl"] = self.acl
+            conditions.append({"acl": self.acl})
+        return self.client.generate_presigned_post(
+            self.bucket,
+            key,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires_in,
+        )
+
+    def read_bytes(self, key, length=None):
+        """First ``length`` bytes of ``key``, all of them by default, and its size."""
+        extra_args = {"Range": "bytes=0-{}".format(length - 1)} if length else {}
+        response = self.client.get_object(Bucket=self.bucket, Key=key, **extra_args)
+        size = response["ContentLength"]
+        if "ContentRange" in response:
+            size = int(response["ContentRange"].rsplit("/", 1)[-1])
+        return response["Body"].read(), size
+
+    def list_keys(self, prefix):
+        """Map every key under ``prefix`` to its size, 1000 keys per request."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        sizes = {}
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                sizes[obj["Key"]] = obj["Size"]
+        return sizes
+
+    def copy(self, source_bucket, source_key, key):
+        extra_args = {"ACL": self.acl} if self.acl else None
+        self.client.copy(
+            {"Bucket": source_bucket, "Key": source_key},
+            self.bucket,
+            key,
+            ExtraArgs=extra_args,
+        )
+
+    def delete_keys(self, keys):
+        """Delete ``keys``, 1000 per request with ``delete_workers`` in parallel."""
+        self._delete_objects(self.bucket, [{"Key": key} for key in keys])
+
+    def _delete_objects(self, bucket_name, objects):
+        batches = [
+            objects[start : start + DELETE_BATCH_SIZE]
+            for start in range(0, len(objects), DELETE_BATCH_SIZE)
+        ]
+        self._delete_batches(bucket_name, batches)
+
+    def _delete_batches(self, bucket_name, batches):
+        def delete(batch):
+            if not batch:
+                return
+            response = self.client.delete_objects(
+                Bucket=bucket_name, Delete={"Objects": batch, "Quiet": True}
+            )
+            errors = response.get("Errors")
+            if errors:
+                raise RuntimeError(
+                    "Could not delete {} objects of {}, first: {}".format(
+                        len(errors), bucket_name, errors[0]
+                    )
+                )
+
+        with ThreadPoolExecutor(max_workers=self.delete_workers) as pool:
+            for _ in pool.map(delete, batches):
+                pass
+
+    def _version_batches(self, bucket_name, prefix=""):
+        """Every version and delete marker under ``prefix``, 1000 at a time."""
+        paginator = self.client.get_paginator("list_object_versions")
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=prefix,
+            PaginationConfig={"PageSize": DELETE_BATCH_SIZE},
+        )
+        for page in pages:
+            yield [
+                {"Key": version["Key"], "VersionId": version["VersionId"]}
+                for version in page.get("Versions", []) + page.get("DeleteMarkers", [])
+            ]
+
+    def delete_prefix(self, prefix):
+        """Delete every object version under ``prefix``.
+
+        The listing is done before deleting anything, removing versions
+        while paging through them would invalidate the version markers.
+        """
+        batches = list(self._version_batches(self.bucket, prefix))
+        self._delete_batches(self.bucket, batches)
+
+    def delete_album(self, album_url):
+        self.delete_prefix(self.album_prefix(album_url))
+
+    def delete_bucket(self, bucket_name):
+        """Empty and remove a legacy bucket-per-album bucket."""
+        batches = list(self._version_batches(bucket_name))
+        self._delete_batches(bucket_name, batches)
+        self.client.delete_bucket(Bucket=bucket_name)
+
+
+class LocalStorage(object):
+    """Photos on the local disk, served by the app through ``send_file``.
+
+    Meant for self-hosted deployments and tests: keys map to files under
+    ``root`` and ``base_url`` is the url prefix of the ``main.get_photo``
+    route.
+    """
+
+    bucket = None
+
+    def __init__(self, root, base_url="/photos/", max_age=365 * 24 * 3600):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url
+        self.max_age = max_age
+
+    album_prefix = staticmethod(S3Storage.album_prefix)
+
+    def url(self, key):
+        return self.base_url + key
+
+    def key_from_url(self, url):
+        return self.bucket, urlparse(url).path[len(self.base_url) :]
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError("Key outside of the storage root: {}".format(key))
+        return path
+
+    def put(self, key, stream):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target then rename, readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                shutil.copyfileobj(stream, tmp, 1024 * 1024)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def upload_files(self, album_url, files, on_result=None, keys=None):
+        if keys is None:
+            keys = [make_key(f.filename, self.album_prefix(album_url)) for f in files]
+        results = []
+        for file, key in zip(files, keys):
+            try:
+                with file.stream as stream:
+                    self.put(key, stream)
+                result = UploadResult(file.filename, key, None)
+            except Exception as e:
+                result = UploadResult(file.filename, key, e)
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+    def copy(self, source_bucket, source_key, key):
+        if source_bucket is not None:
+            raise ValueError("Local storage can only copy its own files")
+        with open(self.path(source_key), "rb") as source:
+            self.put(key, source)
+
+    def read_bytes(self, key, length=None):
+        path = self.path(key)
+        with open(path, "rb") as f:
+            return f.read(length or -1), os.path.getsize(path)
+
+    def delete_keys(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self.path(prefix), ignore_errors=True)
+
+    def delete_album(self, album_url):
+        self.delete_prefix(self.album_prefix(album_url))
+
+    def delete_bucket(self, bucket_name):
+        pass
+
+    def send(self, key):
+        """Serve ``key`` with Range, ETag and Last-Modified support."""
+        return send_from_directory(self.root, key, cache_timeout=self.max_age)
+
+
+class Storage(object):
+    """Flask extension giving access to the configured storage backend."""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        storage_type = app.config.get("STORAGE_TYPE", "s3")
+        if storage_type == "s3":
+            self.backend = S3Storage(
+                app.config.get("S3_BUCKET"),
+                region=app.config.get("S3_REGION", "eu-west-1"),
+                acl=app.config.get("S3_ACL"),
+                upload_workers=app.config.get("S3_UPLOAD_WORKERS", 8),
+                multipart_threshold=app.config.get(
+                    "S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024
+                ),
+                delete_workers=app.config.get("S3_DELETE_WORKERS", 4),
+                endpoint_url=app.config.get("S3_ENDPOINT_URL"),
+            )
+        elif storage_type == "local":
+            self.backend = LocalStorage(
+                app.config.get("UPLOADED_PHOTOS_DEST"),
+                base_url=app.config.get("LOCAL_STORAGE_URL", "/photos/"),
+                max_age=app.config.get("LOCAL_STORAGE_MAX_AGE", 365 * 24 * 3600),
+            )
+        else:
+            raise ValueError("Unknown STORAGE_TYPE {}".format(storage_type))
+
+    def __getattr__(self, name):
+        if self.backend is None:
+            raise RuntimeError("Storage used before init_app")
+        return getattr(self.backend, name)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Leading bytes of the accepted image formats
+SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+SIGNATURE_LENGTH = 12
+
+
+def looks_like_image(head):
+    # HEIC/HEIF: ISO base media file with an "ftyp" box first
+    return head.startswith(SIGNATURES) or head[4:8] == b"ftyp"
+
+
+class SpoolFile(object):
+    """Uploaded part written straight to the spool directory as it arrives.
+
+    Hashes the content and enforces ``max_size`` chunk by chunk, so a request
+    never holds more than the parser buffer in memory and oversized files
+    are rejected without being fully received.
+    """
+
+    def __init__(self, directory, max_size=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self.max_size = max_size
+        self.size = 0
+        self.claimed = False
+        self._sha256 = hashlib.sha256()
+        self._head = b""
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise RequestEntityTooLarge(
+                "Files can't be larger than {} bytes".format(self.max_size)
+            )
+        if len(self._head) < SIGNATURE_LENGTH:
+            self._head += data[: SIGNATURE_LENGTH - len(self._head)]
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def is_image(self):
+        return looks_like_image(self._head)
+
+    def claim(self, path):
+        """Move the spooled content to ``path``, it won't be removed anymore."""
+        self._file.close()
+        os.replace(self.path, path)
+        self.path = path
+        self.claimed = True
+
+    def discard(self):
+        self._file.close()
+        if not self.claimed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingRequest(Request):
+    """Request spooling file parts to ``INGEST_SPOOL_DIR`` instead of memory.
+
+    The whole body is capped by ``MAX_CONTENT_LENGTH`` and every file by
+    ``MAX_FILE_SIZE``. Parts not claimed by the view are removed when the
+    request ends.
+    """
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        spool_file = SpoolFile(
+            os.path.join(current_app.config["INGEST_SPOOL_DIR"], "incoming"),
+            max_size=current_app.config.get("MAX_FILE_SIZE"),
+        )
+        self.__dict__.setdefault("_spool_files", []).append(spool_file)
+        return spool_file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for spool_file in self.__dict__.get("_spool_files", []):
+                spool_file.discard()
@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+VerifiedToken = namedtuple("VerifiedToken", ["payload", "permissions", "expires_at"])
+
+
+class VerifiedTokenCache(object):
+    """Bounded LRU of already verified JWT payloads.
+
+    Entries are keyed by the sha256 of the raw token, so the token itself is
+    never kept in memory, and expire at the token's ``exp`` claim. Only
+    successfully verified tokens are stored.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get("TOKEN_CACHE_SIZE", self.maxsize)
+
+    @staticmethod
+    def _key(token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, payload):
+        entry = VerifiedToken(
+            payload=payload,
+            permissions=frozenset(payload.get("permissions") or ()),
+            expires_at=payload.get("exp", 0),
+        )
+        if self.maxsize <= 0 or entry.expires_at <= time.time():
+            return entry
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
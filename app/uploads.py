@@ -0,0 +1,85 @@
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+from werkzeug.utils import secure_filename
+
+UploadResult = namedtuple("UploadResult", ["filename", "key", "error"])
+
+# delete_objects accepts at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+
+# Stored keys never change content
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_key(filename, prefix=""):
+    extension = secure_filename(filename).rsplit(".", 1)[-1].lower()
+    return "{}{}.{}".format(prefix, uuid.uuid4().hex[:16], extension)
+
+
+def _upload_one(client, bucket_name, file, key, transfer_config, acl, on_result):
+    result = _put(client, bucket_name, file, key, transfer_config, acl)
+    if on_result is not None:
+        on_result(result)
+    return result
+
+
+def _put(client, bucket_name, file, key, transfer_config, acl):
+    try:
+        extra_args = {
+            "ContentType": file.mimetype or "application/octet-stream",
+            "CacheControl": CACHE_CONTROL,
+        }
+        if acl:
+            extra_args["ACL"] = acl
+        with file.stream as stream:
+            client.upload_fileobj(
+                stream, bucket_name, key, ExtraArgs=extra_args, Config=transfer_config
+            )
+        return UploadResult(file.filename, key, None)
+    except Exception as e:
+        return UploadResult(file.filename, key, e)
+
+
+def upload_files(
+    client,
+    bucket_name,
+    files,
+    key_prefix="",
+    max_workers=8,
+    multipart_threshold=8 * 1024 * 1024,
+    acl=None,
+    on_result=None,
+    keys=None,
+):
+    """Upload ``files`` (FileStorage objects) to ``bucket_name`` concurrently.
+
+    Uploads run on a bounded thread pool and files above
+    ``multipart_threshold`` are sent as multipart uploads. Every file gets an
+    ``UploadResult``, in the order of ``files``; failed ones carry the error.
+    ``client`` must be a boto3 S3 client, which unlike resources is thread
+    safe. ``on_result`` is called from the pool with each result as soon as
+    its upload finishes. ``keys`` overrides the generated object keys.
+    """
+    if keys is None:
+        keys = [make_key(file.filename, key_prefix) for file in files]
+    transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold, max_concurrency=4
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(
+                _upload_one,
+                client,
+                bucket_name,
+                file,
+                key,
+                transfer_config,
+                acl,
+                on_result,
+            )
+            for file, key in zip(files, keys)
+        ]
+        return [future.result() for future in futures]
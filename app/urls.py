@@ -0,0 +1,69 @@
+import time
+
+from app.cache import MemoryBackend
+
+
+class PhotoUrls(object):
+    """Urls of stored photos, signed when the objects are private.
+
+    Signatures are bucketed in windows of ``PHOTO_URL_WINDOW`` seconds: the
+    url of a key is signed at the start of the window, valid until the end
+    of the next one, so every process hands out the same string during a
+    window and browsers or a caching proxy can keep the photo. Pages
+    embedding it can be cached one window. Urls are memoized per process
+    until their window ends, only to spare the signing. ``PHOTO_URL_HOST``
+    replaces the scheme and host of the urls, to serve them through a
+    caching proxy that forwards to the storage.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.window = 3600
+        self.host = None
+        self.memo = MemoryBackend(max_entries=100000)
+
+    def init_app(self, app):
+        self.window = app.config.get("PHOTO_URL_WINDOW", 3600)
+        self.host = app.config.get("PHOTO_URL_HOST")
+        self.memo = MemoryBackend(app.config.get("PHOTO_URL_CACHE_SIZE", 100000))
+
+    @property
+    def signed(self):
+        """Objects readable through their ACL or served by the app are not."""
+        backend = self.storage.backend
+        return hasattr(backend, "presigned_url") and "public" not in (backend.acl or "")
+
+    def window_start(self, now=None):
+        now = time.time() if now is None else now
+        return int(now // self.window * self.window)
+
+    def lifetime(self, now=None):
+        """Seconds the urls handed out at ``now`` stay valid, ``None`` if forever."""
+        if not self.signed:
+            return None
+        now = time.time() if now is None else now
+        return self.window_start(now) + 2 * self.window - now
+
+    def url(self, key):
+        if not self.signed:
+            return self._on_host(self.storage.url(key))
+        now = time.time()
+        start = self.window_start(now)
+        memo_key = "{}:{}".format(start, key)
+        url = self.memo.get(memo_key)
+        if url is None:
+            url = self._on_host(
+                self.storage.presigned_url(key, 2 * self.window, signed_at=start)
+            )
+            self.memo.set(memo_key, url, start + self.window - now)
+        return url
+
+    def _on_host(self, url):
+        if not self.host:
+            return url
+        if "://" in url:
+            url = "/" + url.split("://", 1)[1].split("/", 1)[-1]
+        return self.host.rstrip("/") + url
+
+    def clear(self):
+        self.memo.clear()
@@ -1,22 +1,119 @@
 import os
+import tempfile
 
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def replica_binds(urls):
+    """``SQLALCHEMY_BINDS`` entries of comma separated replica urls."""
+    urls = [url.strip() for url in (urls or "").split(",") if url.strip()]
+    return {"replica_{}".format(index): url for index, url in enumerate(urls)}
+
+
 class Config(object):
     SECRET_KEY = os.environ.get("SECRET_KEY")
+    # Key scrambling album ids into their url slugs, SECRET_KEY if unset.
+    # Changing it changes the url of every album created since
+    SLUG_KEY = os.environ.get("SLUG_KEY")
     API_KEY = os.environ.get("API_KEY")
     # Enable debug mode.
     DEBUG = os.environ.get("DEBUG")
 
     # Connect to the database
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI")
+    # Read replicas of it, comma separated urls. The views marked read_only
+    # query them while their lag is under REPLICA_MAX_LAG seconds, and after
+    # a write a client reads from the primary for REPLICA_STICKY_SECONDS
+    SQLALCHEMY_BINDS = replica_binds(os.environ.get("SQLALCHEMY_REPLICA_URIS"))
+    REPLICA_BINDS = sorted(SQLALCHEMY_BINDS)
+    REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("REPLICA_LAG_CHECK_INTERVAL", 1))
+    REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 10))
 
     # Disable track modifications option
     SQLALCHEMY_TRACK_MODIFICATIONS = os.environ.get("SQLALCHEMY_TRACK_MODIFICATIONS")
 
-    UPLOADED_PHOTOS_DEST = os.path.join(basedir, "app/static/uploads/")
+    # Connection pool of each worker process (ignored for SQLite)
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+    # Milliseconds, PostgreSQL only, for the queries of web requests: migrations
+    # and the manage.py commands run without a timeout
+    DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 5000))
+
+    # Requests running more queries than their budget are logged
+    QUERY_BUDGET = int(os.environ.get("QUERY_BUDGET", 10))
+    # Finalizing direct uploads also picks the first photo of the album
+    QUERY_BUDGETS = {"main.api_finalize_upload": 20}
+    # Bearer token required by the /metrics endpoints when set
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # Every album is stored under albums/<album url>/, either in S3_BUCKET
+    # ("s3") or in UPLOADED_PHOTOS_DEST served from LOCAL_STORAGE_URL ("local")
+    STORAGE_TYPE = os.environ.get("STORAGE_TYPE", "s3")
+    UPLOADED_PHOTOS_DEST = os.environ.get(
+        "UPLOADED_PHOTOS_DEST", os.path.join(basedir, "app/static/uploads/")
+    )
+    LOCAL_STORAGE_URL = "/photos/"
+    # Stored keys never change content, so browsers can keep them
+    LOCAL_STORAGE_MAX_AGE = int(os.environ.get("LOCAL_STORAGE_MAX_AGE", 31536000))
+    # Let the front server (nginx X-Accel, Apache) send the files
+    USE_X_SENDFILE = bool(os.environ.get("USE_X_SENDFILE"))
+    S3_BUCKET = os.environ.get("S3_BUCKET")
+    S3_REGION = os.environ.get("S3_REGION", "eu-west-1")
+    # Canned ACL of the stored objects, e.g. "public-read" to serve them
+    # unsigned. Private by default, photos are then shown with signed urls
+    S3_ACL = os.environ.get("S3_ACL")
+    # S3 compatible server to use instead of AWS, e.g. a local MinIO or moto
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+
+    # Signed photo urls are the same for PHOTO_URL_WINDOW seconds in every
+    # worker, each one memoizing up to PHOTO_URL_CACHE_SIZE of them.
+    # PHOTO_URL_HOST (e.g. "https://photos.example.com") serves them through
+    # a caching proxy in front of the storage
+    PHOTO_URL_WINDOW = int(os.environ.get("PHOTO_URL_WINDOW", 3600))
+    PHOTO_URL_HOST = os.environ.get("PHOTO_URL_HOST")
+    PHOTO_URL_CACHE_SIZE = int(os.environ.get("PHOTO_URL_CACHE_SIZE", 100000))
+
+    # Concurrent uploads per album creation, files above the threshold
+    # (in bytes) are sent as multipart uploads
+    S3_UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", 8))
+    S3_MULTIPART_THRESHOLD = int(
+        os.environ.get("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)
+    )
+    # Concurrent delete requests (1000 keys each) when removing albums
+    S3_DELETE_WORKERS = int(os.environ.get("S3_DELETE_WORKERS", 4))
+
+    # Background jobs: "sqlite" shares them between the workers of a host
+    # through JOB_QUEUE_PATH and keeps them across restarts, "memory" keeps
+    # them in each worker process and loses them with it (tests only)
+    JOB_QUEUE_TYPE = os.environ.get("JOB_QUEUE_TYPE", "sqlite")
+    JOB_QUEUE_PATH = os.environ.get(
+        "JOB_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "1pic1day-jobs.db")
+    )
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+    # Seconds without a heartbeat after which a running job of the sqlite
+    # queue is handed to another worker, its process being presumed dead
+    JOB_LEASE = int(os.environ.get("JOB_LEASE", 300))
+    # Upload size caps in bytes, for a whole request and for each file
+    MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 2 * 1024**3))
+    MAX_FILE_SIZE = int(os.environ.get("MAX_FILE_SIZE", 50 * 1024**2))
+    # Browsers upload straight to S3 with presigned POST policies: at most
+    # this many files per album, each policy being valid this many seconds
+    DIRECT_UPLOAD_MAX_FILES = int(os.environ.get("DIRECT_UPLOAD_MAX_FILES", 1000))
+    DIRECT_UPLOAD_EXPIRES = int(os.environ.get("DIRECT_UPLOAD_EXPIRES", 3600))
+    # Processes resizing the uploads, defaults to one per core
+    DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", 0)) or None
+    # Uploads are written here until a job worker sends them to S3
+    INGEST_SPOOL_DIR = os.environ.get(
+        "INGEST_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "1pic1day-spool")
+    )
+    # Spooled uploads older than this many seconds belong to a lost job, they
+    # are removed when a worker starts
+    INGEST_SPOOL_MAX_AGE = int(os.environ.get("INGEST_SPOOL_MAX_AGE", 24 * 3600))
 
     AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
     API_AUDIENCE = os.environ.get("API_AUDIENCE")
@@ -27,3 +124,35 @@ class Config(object):
     AUTH0_CLIENT_SECRET = os.environ.get("AUTH0_CLIENT_SECRET")
     AUTH0_ALLOWED_CALLBACK = os.environ.get("AUTH0_ALLOWED_CALLBACK")
     CONF_URL = os.environ.get("CONF_URL")
+
+    # Signing keys, defaults to https://AUTH0_DOMAIN/.well-known/jwks.json
+    JWKS_URL = os.environ.get("JWKS_URL")
+    JWKS_CACHE_TTL = int(os.environ.get("JWKS_CACHE_TTL", 600))
+    JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30))
+    # Number of verified access tokens kept in memory per worker
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+
+    # Local time ("HH:MM") at which the scheduler picks the photo of the day
+    DAILY_PICK_TIME = os.environ.get("DAILY_PICK_TIME", "00:00")
+    DAILY_PICK_BATCH_SIZE = int(os.environ.get("DAILY_PICK_BATCH_SIZE", 500))
+
+    # Sessions: "cookie" keeps them in Flask's signed cookie, "redis" server
+    # side in SESSION_REDIS_URL, "sqlite" in SESSION_PATH, shared by the
+    # workers of one host only and lost with its disk (e.g. every Heroku dyno
+    # restart), "memory" in each process (tests)
+    SESSION_TYPE = os.environ.get("SESSION_TYPE", "cookie")
+    SESSION_PATH = os.environ.get(
+        "SESSION_PATH", os.path.join(tempfile.gettempdir(), "1pic1day-sessions.db")
+    )
+    SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL")
+
+    # Album pages served to anonymous viewers: "simple", "redis" or "null".
+    # "simple" is per worker, an edit only invalidates the page of the worker
+    # that served it: the others keep theirs RESPONSE_CACHE_SIMPLE_TIMEOUT
+    # seconds at most. Use "redis" to cache pages until the next pick
+    RESPONSE_CACHE_TYPE = os.environ.get("RESPONSE_CACHE_TYPE", "simple")
+    RESPONSE_CACHE_URL = os.environ.get("RESPONSE_CACHE_URL")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+    RESPONSE_CACHE_SIMPLE_TIMEOUT = int(
+        os.environ.get("RESPONSE_CACHE_SIMPLE_TIMEOUT", 30)
+    )
@@ -0,0 +1,22 @@
+import os
+import shutil
+import tempfile
+
+# Must be set before prometheus_client is imported by the master or a worker
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "1pic1day-metrics"),
+)
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    # Samples of a previous run would be merged into the new ones
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -7,6 +7,101 @@ manager = Manager(create_app)
 
 manager.add_command("db", MigrateCommand)
 
+storage_manager = Manager(help="Manage the stored photos")
+
+
+@storage_manager.option("--batch-size", dest="batch_size", type=int, default=500)
+@storage_manager.option("--delete-old", dest="delete_old", action="store_true")
+def migrate(batch_size, delete_old):
+    """Move bucket-per-album albums to the shared S3_BUCKET"""
+    from app.commands import migrate_storage
+
+    migrate_storage(batch_size=batch_size, delete_old=delete_old)
+
+
+@storage_manager.option("--batch-size", dest="batch_size", type=int, default=1000)
+def backfill_keys(batch_size):
+    """Store the key of each image rather than its url"""
+    from app.commands import backfill_image_keys
+
+    backfill_image_keys(batch_size=batch_size)
+
+
+@storage_manager.option("--batch-size", dest="batch_size", type=int, default=200)
+@storage_manager.option("--workers", dest="workers", type=int, default=8)
+def backfill_metadata(batch_size, workers):
+    """Read the dimensions, orientation and placeholder of older images"""
+    from app.commands import backfill_image_metadata
+
+    backfill_image_metadata(batch_size=batch_size, workers=workers)
+
+
+manager.add_command("storage", storage_manager)
+
+
+@manager.command
+def check_indexes():
+    """Fail if a hot query would scan a whole table"""
+    from app.commands import check_query_plans
+
+    failures = check_query_plans()
+    for name, plan in failures.items():
+        print("{} does not use an index:\n{}".format(name, plan))
+    if failures:
+        raise SystemExit(1)
+    print("Every hot query uses an index")
+
+
+@manager.option("--batch-size", dest="batch_size", type=int, default=None)
+@manager.option("--once", dest="once", action="store_true")
+def scheduler(batch_size, once):
+    """Pick the photo of the day of every album at DAILY_PICK_TIME"""
+    from flask import current_app
+    from app.scheduler import run_scheduler
+
+    run_scheduler(
+        batch_size=batch_size or current_app.config["DAILY_PICK_BATCH_SIZE"],
+        once=once,
+    )
+
+
+@manager.option("-o", "--output", dest="output", default="benchmark.json")
+@manager.option("--database", dest="database_url", default=None)
+@manager.option("--yes-drop", dest="drop", action="store_true")
+@manager.option("--sizes", dest="sizes", default="10,1000,100000")
+@manager.option("--requests", dest="requests", type=int, default=200)
+@manager.option("--clients", dest="clients", type=int, default=4)
+@manager.option("--files", dest="files", type=int, default=20)
+def bench(output, database_url, drop, sizes, requests, clients, files):
+    """Benchmark the viewer, upload and auth paths on a scratch database"""
+    from app.benchmarks import run_benchmarks
+
+    try:
+        results = run_benchmarks(
+            output,
+            database_url=database_url,
+            sizes=[int(size) for size in sizes.split(",")],
+            requests=requests,
+            clients=clients,
+            files=files,
+            drop=drop,
+        )
+    except ValueError as e:
+        print(e)
+        raise SystemExit(1)
+    for size, stats in results["get_album"].items():
+        print(
+            "get_album {:>7} images: p50 {:.1f} ms, p99 {:.1f} ms, "
+            "{:.0f} req/s, {} queries".format(
+                size,
+                stats["p50_ms"],
+                stats["p99_ms"],
+                stats["requests_per_second"],
+                stats["queries_per_request"],
+            )
+        )
+    print("Results written to {}".format(output))
+
 
 if __name__ == "__main__":
     manager.run()
@@ -0,0 +1,59 @@
+"""indexes for the hot queries, last_photo_viewed as a foreign key
+
+Revision ID: d41a7c3e95b8
+Revises: b3d9f60e1c24
+Create Date: 2026-10-18 12:20:37.802145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7c3e95b8'
+down_revision = 'b3d9f60e1c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Legacy md5 slugs collide: the oldest album keeps the url, which is the
+    # one lookups returned, the others get their id appended to it
+    op.execute(
+        "UPDATE album SET url = url || '-' || CAST(id AS VARCHAR(20)) "
+        "WHERE id > (SELECT MIN(other.id) FROM album AS other "
+        "WHERE other.url = album.url)"
+    )
+    op.create_index(op.f('ix_album_url'), 'album', ['url'], unique=True)
+    op.create_index(op.f('ix_album_user_id'), 'album', ['user_id'], unique=False)
+    op.create_index('ix_image_album_id_viewed', 'image', ['album_id', 'viewed'], unique=False)
+
+    # last_photo_viewed stored the image url, point to the image row instead
+    with op.batch_alter_table('album') as batch_op:
+        batch_op.add_column(sa.Column('last_photo_viewed_id', sa.Integer(), nullable=True))
+    op.execute(
+        "UPDATE album SET last_photo_viewed_id = ("
+        "SELECT MIN(image.id) FROM image "
+        "WHERE image.album_id = album.id AND image.url = album.last_photo_viewed)"
+    )
+    with op.batch_alter_table('album') as batch_op:
+        batch_op.create_foreign_key(
+            'fk_album_last_photo_viewed_id', 'image', ['last_photo_viewed_id'], ['id']
+        )
+        batch_op.drop_column('last_photo_viewed')
+
+
+def downgrade():
+    with op.batch_alter_table('album') as batch_op:
+        batch_op.add_column(sa.Column('last_photo_viewed', sa.String(length=300), nullable=True))
+    op.execute(
+        "UPDATE album SET last_photo_viewed = ("
+        "SELECT image.url FROM image WHERE image.id = album.last_photo_viewed_id)"
+    )
+    with op.batch_alter_table('album') as batch_op:
+        batch_op.drop_constraint('fk_album_last_photo_viewed_id', type_='foreignkey')
+        batch_op.drop_column('last_photo_viewed_id')
+
+    op.drop_index('ix_image_album_id_viewed', table_name='image')
+    op.drop_index(op.f('ix_album_user_id'), table_name='album')
+    op.drop_index(op.f('ix_album_url'), table_name='album')
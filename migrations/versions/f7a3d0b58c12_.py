@@ -0,0 +1,44 @@
+"""delete the images of an album with it
+
+Revision ID: f7a3d0b58c12
+Revises: e5b7c2a91d36
+Create Date: 2026-10-18 13:48:51.067724
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a3d0b58c12'
+down_revision = 'e5b7c2a91d36'
+branch_labels = None
+depends_on = None
+
+# Names the unnamed constraint of the initial migration when SQLite
+# tables are recreated
+naming_convention = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+}
+
+
+def old_constraint_name():
+    if op.get_bind().dialect.name == 'postgresql':
+        return 'image_album_id_fkey'
+    return 'fk_image_album_id_album'
+
+
+def upgrade():
+    with op.batch_alter_table('image', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(old_constraint_name(), type_='foreignkey')
+        batch_op.create_foreign_key(
+            'fk_image_album_id_album', 'album', ['album_id'], ['id'], ondelete='CASCADE'
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.drop_constraint('fk_image_album_id_album', type_='foreignkey')
+        batch_op.create_foreign_key(
+            'fk_image_album_id_album', 'album', ['album_id'], ['id']
+        )
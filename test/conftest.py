@@ -0,0 +1,35 @@
+import pytest
+
+from app import create_app, db
+from config import Config
+
+
+@pytest.fixture
+def config(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SECRET_KEY = "test"
+        SQLALCHEMY_DATABASE_URI = "sqlite:///{}".format(tmp_path / "primary.db")
+        SQLALCHEMY_BINDS = {}
+        REPLICA_BINDS = []
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+        WTF_CSRF_ENABLED = False
+        JOB_WORKERS = 0
+        SESSION_TYPE = "memory"
+        RESPONSE_CACHE_TYPE = "null"
+        STORAGE_TYPE = "local"
+        UPLOADED_PHOTOS_DEST = str(tmp_path / "uploads")
+        INGEST_SPOOL_DIR = str(tmp_path / "spool")
+        JOB_QUEUE_PATH = str(tmp_path / "jobs.db")
+
+    return TestConfig
+
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
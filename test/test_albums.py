@@ -0,0 +1,48 @@
+import pytest
+
+import app.main.routes as routes
+from app.albums import new_album
+from app.models import Album
+
+
+@pytest.fixture
+def login(app, monkeypatch):
+    client = app.test_client()
+
+    def login(user_id, permissions):
+        monkeypatch.setattr(
+            routes,
+            "verify_decode_jwt",
+            lambda token: {"sub": user_id, "permissions": permissions},
+        )
+        with client.session_transaction() as session:
+            session["jwt_payload"] = {"access_token": "token"}
+            session["profile"] = {"user_id": user_id, "name": user_id, "picture": ""}
+        return client
+
+    return login
+
+
+def test_delete_album(login):
+    album = new_album("album", "alice")
+    album_id, album_url = album.id, album.url
+
+    client = login("alice", ["delete:album"])
+    response = client.delete("/{}/delete".format(album_url))
+    assert response.status_code == 303
+    assert response.location.endswith("/albums")
+    assert Album.query.get(album_id) is None
+
+
+@pytest.mark.parametrize(
+    "user_id, permissions, status",
+    [("alice", [], 401), ("bob", ["delete:album"], 401)],
+)
+def test_delete_album_refused(login, user_id, permissions, status):
+    album = new_album("album", "alice")
+    album_id, album_url = album.id, album.url
+
+    client = login(user_id, permissions)
+    response = client.delete("/{}/delete".format(album_url))
+    assert response.status_code == status
+    assert Album.query.get(album_id) is not None
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+import app.cache
+from app.cache import ResponseCache
+
+
+def response_cache(**config):
+    cache = ResponseCache()
+    cache.init_app(SimpleNamespace(config=config))
+    return cache
+
+
+def test_simple_entries_outlive_other_workers_invalidations_briefly(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(app.cache.time, "time", lambda: now)
+    config = {"RESPONSE_CACHE_TYPE": "simple", "RESPONSE_CACHE_SIMPLE_TIMEOUT": 30}
+    first, second = response_cache(**config), response_cache(**config)
+    first.set("album", "old", 3600)
+    entry = second.set("album", "old", 3600)
+    assert entry["expires_at"] == now + 30
+
+    # The edit only reaches the worker that served it
+    first.invalidate("album")
+    assert first.get("album") is None
+    assert second.get("album")["body"] == "old"
+    now += 30
+    assert second.get("album") is None
+
+
+def test_shared_entries_live_until_the_next_pick():
+    cache = response_cache(RESPONSE_CACHE_TYPE="null")
+    entry = cache.set("album", "page", 3600)
+    assert entry["expires_at"] > app.cache.time.time() + 3500
@@ -0,0 +1,102 @@
+import base64
+import json
+
+import pytest
+from botocore.stub import Stubber
+
+from app import storage
+from app.models import Album
+
+
+@pytest.fixture
+def config(config, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+
+    class S3Config(config):
+        STORAGE_TYPE = "s3"
+        S3_BUCKET = "bucket"
+        MAX_FILE_SIZE = 1000
+
+    return S3Config
+
+
+@pytest.fixture
+def s3(app):
+    with Stubber(storage.backend.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def create_upload(client, name="album", files=("a.jpg", "b.PNG")):
+    return client.post("/api/uploads", json={"name": name, "files": list(files)})
+
+
+def test_uploads_are_presigned(app):
+    response = create_upload(app.test_client())
+    assert response.status_code == 200
+    data = response.get_json()
+    album = Album.query.filter(Album.url == data["album"]).one()
+    assert album.name == "album" and album.images.count() == 0
+    assert data["finalize_url"] == "/api/uploads/{}/finalize".format(album.url)
+
+    first, second = data["uploads"]
+    assert (first["filename"], second["filename"]) == ("a.jpg", "b.PNG")
+    assert first["key"].startswith("albums/{}/".format(album.url))
+    assert first["key"].endswith(".jpg") and second["key"].endswith(".png")
+    assert first["url"].startswith("https://bucket.s3.")
+    assert first["fields"]["key"] == first["key"]
+    assert second["fields"]["Content-Type"] == "image/png"
+    policy = json.loads(base64.b64decode(first["fields"]["policy"]))
+    assert ["content-length-range", 1, 1000] in policy["conditions"]
+    assert {"Content-Type": "image/jpeg"} in policy["conditions"]
+
+
+@pytest.mark.parametrize(
+    "name, files",
+    [("", ["a.jpg"]), ("album", []), ("album", ["a.exe"]), ("x" * 51, ["a.jpg"])],
+)
+def test_bad_upload_requests_are_refused(app, name, files):
+    assert create_upload(app.test_client(), name, files).status_code == 400
+    assert Album.query.count() == 0
+
+
+def test_uploads_are_finalized_once(app, s3):
+    client = app.test_client()
+    data = create_upload(client, files=["a.jpg", "b.jpg", "c.jpg"]).get_json()
+    arrived, too_large, lost = [upload["key"] for upload in data["uploads"]]
+    listing = {
+        "Contents": [{"Key": arrived, "Size": 10}, {"Key": too_large, "Size": 1001}],
+        "IsTruncated": False,
+    }
+    prefix = "albums/{}/".format(data["album"])
+    for _ in range(2):
+        s3.add_response(
+            "list_objects_v2", listing, {"Bucket": "bucket", "Prefix": prefix}
+        )
+
+    keys = {"keys": [arrived, too_large, lost]}
+    result = client.post(data["finalize_url"], json=keys).get_json()
+    assert result["added"] == 1
+    assert result["missing"] == [too_large, lost]
+    album = Album.query.filter(Album.url == data["album"]).one()
+    assert [image.key for image in album.images] == [arrived]
+    assert [image.size for image in album.images] == [10]
+
+    # Retried by the browser, nothing is added twice
+    result = client.post(data["finalize_url"], json=keys).get_json()
+    assert result["added"] == 0
+    assert album.images.count() == 1
+
+    # The new album shows its photo right away, through a signed url
+    page = client.get(result["url"]).get_data(as_text=True)
+    assert "X-Amz-Signature=" in page and arrived in page
+
+
+def test_other_users_albums_are_not_finalized(app):
+    data = create_upload(app.test_client()).get_json()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["profile"] = {"user_id": "bob", "name": "bob", "picture": ""}
+    assert client.post(data["finalize_url"], json={}).status_code == 404
+    assert client.post("/api/uploads/missing/finalize").status_code == 404
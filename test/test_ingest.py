@@ -0,0 +1,95 @@
+import io
+import os
+import threading
+
+from PIL import Image as PILImage
+
+import app.main.ingest as ingest
+from app import db, jobs, storage
+from app.albums import delete_albums
+from app.models import Album, Blob, Image
+
+
+def photo(color):
+    stream = io.BytesIO()
+    PILImage.new("RGB", (600, 400), color).save(stream, "PNG")
+    stream.seek(0)
+    return stream
+
+
+def upload(app, name, colors):
+    app.test_client().post(
+        "/create",
+        data={
+            "name": name,
+            "photo": [
+                (photo(color), "{}.png".format(i)) for i, color in enumerate(colors)
+            ],
+        },
+        content_type="multipart/form-data",
+    )
+    job = jobs.run_one(timeout=0)
+    assert job["state"] == "done", job["error"]
+    # Progress counts photos, not stored objects, duplicates included
+    assert job["total"] == job["done"] == len(colors)
+    return Album.query.filter(Album.name == name).one()
+
+
+def run_jobs():
+    while jobs.run_one(timeout=0) is not None:
+        pass
+
+
+def assert_stored(album):
+    for image in album.images:
+        blob = Blob.query.get(image.blob_id)
+        assert blob is not None
+        assert blob.refcount == Image.query.filter(Image.blob_id == blob.id).count()
+        for key in blob.keys():
+            assert os.path.exists(storage.backend.path(key)), key
+
+
+def test_duplicates_share_a_blob(app):
+    red, blue = (200, 0, 0), (0, 0, 200)
+    album = upload(app, "first", [red, red, blue])
+    assert album.images.count() == 3
+    assert sorted(blob.refcount for blob in Blob.query) == [1, 2]
+    assert_stored(album)
+
+    second = upload(app, "second", [red])
+    assert Blob.query.count() == 2
+    assert_stored(second)
+
+
+def test_blob_released_during_ingestion_is_stored_again(app, monkeypatch):
+    red, blue = (200, 0, 0), (0, 0, 200)
+    first = upload(app, "first", [red])
+    first_id = first.id
+    old_keys = Blob.query.one().keys()
+    make_all_derivatives = ingest.make_all_derivatives
+    deleted = []
+
+    def delete_first():
+        with app.app_context():
+            delete_albums([Album.query.get(first_id)])
+            db.session.remove()
+
+    def resize_slowly(paths, workers=None):
+        # The only album using the red blob is deleted while "second" resizes
+        if not deleted:
+            deleted.append(True)
+            thread = threading.Thread(target=delete_first)
+            thread.start()
+            thread.join()
+        return make_all_derivatives(paths, workers=workers)
+
+    monkeypatch.setattr(ingest, "make_all_derivatives", resize_slowly)
+    second_id = upload(app, "second", [red, blue]).id
+    # The objects of the released blob are deleted after the new upload
+    run_jobs()
+    second = Album.query.get(second_id)
+
+    assert Album.query.get(first_id) is None
+    assert second.images.count() == 2
+    assert_stored(second)
+    assert not set(old_keys) & {key for blob in Blob.query for key in blob.keys()}
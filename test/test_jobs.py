@@ -0,0 +1,148 @@
+import os
+import time
+
+import pytest
+
+from app import create_app, jobs
+from app.albums import new_album
+from app.jobs import DONE, FAILED, QUEUED, RUNNING, MemoryJobStore, SQLiteJobStore
+from app.main.ingest import ingest_job_id, sweep_spool
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    calls = []
+
+    def echo(payload, progress):
+        progress.set_total(2)
+        progress.advance()
+        calls.append(payload)
+
+    def fail(payload, progress):
+        raise ValueError("broken photo")
+
+    monkeypatch.setitem(jobs.tasks, "echo", echo)
+    monkeypatch.setitem(jobs.tasks, "fail", fail)
+    return calls
+
+
+def test_jobs_report_their_progress(app, tasks):
+    job_id = jobs.enqueue("echo", {"n": 1}, total=5)
+    assert jobs.get(job_id)["state"] == QUEUED
+    job = jobs.run_one(timeout=0)
+    assert job["id"] == job_id and job["state"] == DONE
+    assert (job["total"], job["done"]) == (2, 1)
+    assert tasks == [{"n": 1}]
+    assert jobs.run_one(timeout=0) is None
+
+
+def test_failed_jobs_keep_their_error(app, tasks):
+    job_id = jobs.enqueue("fail", {}, job_id="fixed-id")
+    assert job_id == "fixed-id"
+    job = jobs.run_one(timeout=0)
+    assert job["state"] == FAILED and job["error"] == "broken photo"
+
+
+def test_queued_jobs_survive_a_restart(app, config, tasks):
+    assert jobs.durable
+    job_id = jobs.enqueue("echo", {"n": 1})
+    # A new process on the same host finds the job
+    create_app(config)
+    assert jobs.run_one(timeout=0)["id"] == job_id
+    assert tasks == [{"n": 1}]
+
+
+def test_jobs_of_dead_workers_are_claimed_again(app, config, tasks):
+    job_id = jobs.enqueue("echo", {"n": 1})
+    assert jobs.store.claim(timeout=0)["state"] == RUNNING
+    assert jobs.store.claim(timeout=0) is None
+
+    # Past the lease without a heartbeat, its worker is presumed dead
+    store = SQLiteJobStore(config.JOB_QUEUE_PATH, lease=0)
+    time.sleep(0.01)
+    assert store.claim(timeout=0)["id"] == job_id
+
+
+def test_memory_store_prunes_finished_jobs():
+    store = MemoryJobStore(max_finished=2)
+    assert not store.durable
+    for index in range(4):
+        now = time.time()
+        store.put(
+            {
+                "id": str(index),
+                "state": DONE,
+                "updated_at": now + index,
+                "created_at": now,
+            }
+        )
+    assert [store.get(str(index)) is None for index in range(4)] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert store.update("missing", state=DONE) is None
+
+
+def progress(app, album_url):
+    return app.test_client().get("/{}/progress".format(album_url)).get_json()
+
+
+def test_progress_of_lost_jobs_is_failed(app):
+    album = new_album("album", "ANON")
+    assert progress(app, album.url) == {
+        "state": "failed",
+        "total": 0,
+        "done": 0,
+        "error": "The upload was lost",
+    }
+
+
+def test_progress_of_jobs_of_other_processes_is_unknown(app, monkeypatch):
+    monkeypatch.setattr(jobs, "store", MemoryJobStore())
+    album = new_album("album", "ANON")
+    assert progress(app, album.url) == {"state": "unknown", "total": 0, "done": 0}
+
+
+def test_progress_of_queued_jobs(app):
+    album = new_album("album", "ANON")
+    jobs.enqueue("echo", {}, job_id=ingest_job_id(album.url), total=3)
+    assert progress(app, album.url) == {
+        "state": QUEUED,
+        "total": 3,
+        "done": 0,
+        "error": None,
+    }
+    assert app.test_client().get("/missing/progress").status_code == 404
+
+
+def make_spool(path, age, directory=False):
+    if directory:
+        os.makedirs(path)
+        open(os.path.join(path, "00000"), "w").close()
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_lost_spool_directories_are_removed(tmp_path):
+    root = str(tmp_path / "spool")
+    lost = make_spool(os.path.join(root, "lost"), 7200, True)
+    queued = make_spool(os.path.join(root, "queued"), 60, True)
+    part = make_spool(os.path.join(root, "incoming", "part"), 7200)
+    receiving = make_spool(os.path.join(root, "incoming", "receiving"), 60)
+
+    assert sorted(sweep_spool(root, 3600)) == sorted([lost, part])
+    assert sorted(os.listdir(root)) == ["incoming", "queued"]
+    assert os.path.exists(queued) and os.path.exists(receiving)
+    assert sweep_spool(str(tmp_path / "missing"), 3600) == []
+
+
+def test_workers_sweep_the_spool_on_start(app):
+    lost = make_spool(os.path.join(app.config["INGEST_SPOOL_DIR"], "lost"), 90000, True)
+    app.test_client().get("/")
+    assert not os.path.exists(lost)
@@ -0,0 +1,198 @@
+import threading
+import time
+
+import pytest
+from jose import jwt
+
+import app.jwks
+from app import jwks_cache
+from app.benchmarks import make_signing_key
+from app.jwks import JWKSCache
+from app.main.routes import AuthError, verify_decode_jwt
+
+URL = "https://issuer.invalid/.well-known/jwks.json"
+
+
+def jwks(*kids):
+    return {"keys": [{"kty": "RSA", "kid": kid, "n": "n", "e": "AQAB"} for kid in kids]}
+
+
+class Issuer(object):
+    """``fetch`` of a ``JWKSCache``, serving ``kids`` until told to fail."""
+
+    def __init__(self, *kids):
+        self.kids = kids
+        self.error = None
+        self.fetches = 0
+
+    def __call__(self, url):
+        self.fetches += 1
+        if self.error is not None:
+            raise self.error
+        return jwks(*self.kids)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.jwks.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_keys_are_served_from_memory_until_the_ttl(clock):
+    issuer = Issuer("a")
+    cache = JWKSCache(ttl=600, fetch=issuer)
+    assert cache.get_key("a", URL)["kid"] == "a"
+    clock[0] += 599
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert issuer.fetches == 1
+
+    issuer.kids = ("b",)
+    clock[0] += 1
+    assert cache.get_key("a", URL) is None
+    assert cache.get_key("b", URL)["kid"] == "b"
+    assert issuer.fetches == 2
+
+
+def test_unknown_kid_refreshes_once_per_interval(clock):
+    issuer = Issuer("a")
+    cache = JWKSCache(min_refresh_interval=30, fetch=issuer)
+    assert cache.get_key("a", URL) is not None
+
+    # The issuer rotated its keys, the new kid is fetched right away
+    clock[0] += 30
+    issuer.kids = ("a", "b")
+    assert cache.get_key("b", URL)["kid"] == "b"
+    assert issuer.fetches == 2
+
+    # Forged kids don't make every request hit the issuer
+    for _ in range(10):
+        assert cache.get_key("forged", URL) is None
+    assert issuer.fetches == 2
+    clock[0] += 30
+    assert cache.get_key("forged", URL) is None
+    assert issuer.fetches == 3
+
+
+def test_only_one_thread_refreshes(clock):
+    fetching = threading.Event()
+    release = threading.Event()
+    issuer = Issuer("a")
+
+    def slow_fetch(url):
+        fetching.set()
+        release.wait(5)
+        return issuer(url)
+
+    cache = JWKSCache(fetch=slow_fetch)
+    results = []
+
+    def get_key():
+        results.append(cache.get_key("a", URL))
+
+    threads = [threading.Thread(target=get_key) for _ in range(8)]
+    threads[0].start()
+    fetching.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert issuer.fetches == 1
+    assert [key["kid"] for key in results] == ["a"] * 8
+
+
+def test_stale_keys_outlive_a_failing_issuer(clock):
+    issuer = Issuer("a")
+    cache = JWKSCache(ttl=600, min_refresh_interval=30, fetch=issuer)
+    assert cache.get_key("a", URL) is not None
+
+    issuer.error = OSError("issuer unreachable")
+    clock[0] += 600
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert issuer.fetches == 2
+    clock[0] += 30
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert issuer.fetches == 3
+
+    issuer.error = None
+    clock[0] += 30
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert issuer.fetches == 4
+    assert cache.get_key("a", URL)["kid"] == "a"
+    assert issuer.fetches == 4
+
+
+def test_failing_issuer_without_keys_raises(clock):
+    issuer = Issuer("a")
+    issuer.error = OSError("issuer unreachable")
+    cache = JWKSCache(fetch=issuer)
+    with pytest.raises(OSError):
+        cache.get_key("a", URL)
+
+
+@pytest.fixture(scope="module")
+def signing_key(tmp_path_factory):
+    return make_signing_key(str(tmp_path_factory.mktemp("jwks")))
+
+
+def test_keys_are_read_from_a_file_url(signing_key):
+    _, url = signing_key
+    cache = JWKSCache()
+    key = cache.get_key("bench", url)
+    assert key["kty"] == "RSA" and key["use"] == "sig"
+    cache.clear()
+    assert cache.get_key("other", url) is None
+
+
+@pytest.fixture
+def issuer(app, signing_key):
+    private_key, url = signing_key
+    app.config.update(JWKS_URL=url, AUTH0_DOMAIN="issuer.invalid", API_AUDIENCE="api")
+    jwks_cache.clear()
+    yield private_key
+    jwks_cache.clear()
+
+
+def make_token(private_key, kid="bench", lifetime=3600, audience="api"):
+    now = int(time.time())
+    return jwt.encode(
+        {
+            "sub": "alice",
+            "aud": audience,
+            "iss": "https://issuer.invalid/",
+            "iat": now,
+            "exp": now + lifetime,
+            "permissions": ["get:albums"],
+        },
+        private_key,
+        algorithm="RS256",
+        headers={"kid": kid},
+    )
+
+
+def auth_error(token):
+    with pytest.raises(AuthError) as error:
+        verify_decode_jwt(token)
+    return error.value.status_code, error.value.error["code"]
+
+
+def test_verify_decode_jwt(issuer):
+    payload = verify_decode_jwt(make_token(issuer))
+    assert payload["sub"] == "alice"
+    assert payload["permissions"] == ["get:albums"]
+
+
+def test_verify_decode_jwt_rejects_bad_tokens(issuer):
+    assert auth_error(make_token(issuer, kid="unknown")) == (400, "invalid_header")
+    assert auth_error(make_token(issuer, lifetime=-60)) == (401, "token_expired")
+    assert auth_error(make_token(issuer, audience="other")) == (401, "invalid_claims")
+    assert auth_error(make_token(issuer)[:-4]) == (400, "invalid_header")
+    token = jwt.encode({"sub": "alice"}, issuer, algorithm="RS256")
+    assert auth_error(token) == (401, "invalid_header")
+
+
+def test_verify_decode_jwt_without_jwks(issuer, app, tmp_path):
+    app.config["JWKS_URL"] = "file://{}".format(tmp_path / "missing.json")
+    assert auth_error(make_token(issuer)) == (503, "jwks_unavailable")
@@ -0,0 +1,21 @@
+from app.commands import check_query_plans, explain, hot_queries, uses_index
+from app.models import Image
+
+
+def test_hot_queries_use_an_index(app):
+    assert check_query_plans() == {}
+
+
+def test_every_hot_query_is_checked(app):
+    assert set(hot_queries()) == {
+        "album by url",
+        "albums of a user",
+        "page of a user's albums",
+        "unviewed images of an album",
+        "images of an album",
+    }
+
+
+def test_table_scans_are_reported(app):
+    plan = explain(Image.query.filter(Image.size == 1))
+    assert not uses_index(plan, "sqlite")
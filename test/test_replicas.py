@@ -0,0 +1,112 @@
+import shutil
+import time
+
+import pytest
+from flask import jsonify
+
+from app import create_app, db, replicas
+from app.models import Album
+from app.replicas import PRIMARY_UNTIL, read_only
+
+
+def album_names():
+    return jsonify(sorted(album.name for album in Album.query))
+
+
+@pytest.fixture
+def app(config, tmp_path):
+    """Primary holding albums "first" and "second", the replica only "first"."""
+
+    class ReplicaConfig(config):
+        SQLALCHEMY_BINDS = {"replica_0": "sqlite:///{}".format(tmp_path / "replica.db")}
+        REPLICA_BINDS = ["replica_0"]
+        REPLICA_LAG_CHECK_INTERVAL = 0
+
+    app = create_app(ReplicaConfig)
+    app.add_url_rule("/names", "names", read_only(album_names))
+    app.add_url_rule("/primary-names", "primary_names", album_names)
+
+    @app.route("/rename", methods=["POST"])
+    def rename():
+        Album.query.filter(Album.name == "first").update({Album.name: "renamed"})
+        db.session.commit()
+        return "ok"
+
+    @app.route("/add")
+    @read_only
+    def add():
+        Album("added", "added").insert()
+        return album_names()
+
+    @app.route("/max-age")
+    def max_age():
+        Album.query.count()
+        return jsonify(replicas.max_age(3600))
+
+    app.add_url_rule("/replica-max-age", "replica_max_age", read_only(max_age))
+
+    with app.app_context():
+        db.create_all()
+        Album("first", "first").insert()
+        db.session.remove()
+        # The replica caught up, then the primary got one more album
+        shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+        Album("second", "second").insert()
+        db.session.remove()
+    # Outside of an app context, each request gets its own like in production
+    yield app
+
+
+def replica_names(app):
+    engine = db.get_engine(app, bind="replica_0")
+    return sorted(name for (name,) in engine.execute("SELECT name FROM album"))
+
+
+def test_read_only_views_read_the_replica(app):
+    assert app.test_client().get("/names").get_json() == ["first"]
+
+
+def test_other_views_read_the_primary(app):
+    assert app.test_client().get("/primary-names").get_json() == ["first", "second"]
+
+
+def test_lagging_replica_is_skipped(app, monkeypatch):
+    monkeypatch.setattr(replicas, "lag", lambda bind_key: 60.0)
+    assert app.test_client().get("/names").get_json() == ["first", "second"]
+
+    monkeypatch.setattr(replicas, "lag", lambda bind_key: 0.0)
+    assert app.test_client().get("/names").get_json() == ["first"]
+
+
+def test_unreachable_replica_is_skipped(app, monkeypatch):
+    def lag(bind_key):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(replicas, "lag", lag)
+    assert app.test_client().get("/names").get_json() == ["first", "second"]
+
+
+def test_clients_read_their_own_writes(app):
+    client = app.test_client()
+    assert client.post("/rename").status_code == 200
+    assert client.get("/names").get_json() == ["renamed", "second"]
+    # Other clients keep reading the replica
+    assert app.test_client().get("/names").get_json() == ["first"]
+
+    with client.session_transaction() as session:
+        session[PRIMARY_UNTIL] = time.time() - 1
+    assert client.get("/names").get_json() == ["first"]
+
+
+def test_writes_of_read_only_views_go_to_the_primary(app):
+    client = app.test_client()
+    assert client.get("/add").get_json() == ["added", "first", "second"]
+    assert replica_names(app) == ["first"]
+    # The write also sticks the next reads of the client to the primary
+    assert client.get("/names").get_json() == ["added", "first", "second"]
+
+
+def test_pages_read_from_a_replica_are_cached_briefly(app):
+    client = app.test_client()
+    assert client.get("/replica-max-age").get_json() == replicas.max_lag
+    assert client.get("/max-age").get_json() == 3600
@@ -0,0 +1,181 @@
+import datetime
+import random
+
+from sqlalchemy import event
+
+import app.scheduler as scheduler
+from app import db
+from app.albums import new_album
+from app.models import Album, DailyPick, Image
+from app.picker import current_pick
+from app.scheduler import (
+    last_rollover,
+    next_rollover,
+    pick_day,
+    roll_over,
+    run_scheduler,
+)
+
+DAY = datetime.date(2026, 1, 1)
+
+
+def make_album(image_count, name="album"):
+    album = new_album(name, "alice")
+    for index in range(image_count):
+        db.session.add(Image("{}/{}.jpg".format(name, index), album.id))
+    db.session.commit()
+    return album
+
+
+def picks(album_id):
+    return [
+        pick.image_id
+        for pick in DailyPick.query.filter(DailyPick.album_id == album_id).order_by(
+            DailyPick.day
+        )
+    ]
+
+
+def roll_over_days(count, **kwargs):
+    for day in range(count):
+        roll_over(DAY + datetime.timedelta(days=day), **kwargs)
+
+
+def test_rollover_days(app):
+    app.config["DAILY_PICK_TIME"] = "06:30"
+    before = datetime.datetime(2026, 1, 2, 6, 29)
+    after = datetime.datetime(2026, 1, 2, 6, 30)
+    assert pick_day(before) == datetime.date(2026, 1, 1)
+    assert pick_day(after) == datetime.date(2026, 1, 2)
+    assert last_rollover(after) == after
+    assert next_rollover(before) == after
+    assert next_rollover(after) == datetime.datetime(2026, 1, 3, 6, 30)
+
+
+def test_every_image_is_picked_once_per_cycle(app):
+    album = make_album(4)
+    album_id = album.id
+    image_ids = sorted(image.id for image in album.images)
+    roll_over_days(8, rng=random.Random(1))
+
+    first, second = picks(album_id)[:4], picks(album_id)[4:]
+    assert sorted(first) == sorted(second) == image_ids
+    assert current_pick(album_id, DAY + datetime.timedelta(days=7)).image_id == (
+        second[-1]
+    )
+    # The images of the running cycle shown so far
+    assert Image.query.filter(Image.viewed.is_(True)).count() == 4
+
+
+def test_rollover_is_done_once_a_day(app):
+    album_id = make_album(2).id
+    assert roll_over(DAY) == 1
+    assert roll_over(DAY) == 0
+    assert len(picks(album_id)) == 1
+    later = DAY + datetime.timedelta(days=3)
+    assert current_pick(album_id, later).day == DAY
+    assert current_pick(album_id, DAY - datetime.timedelta(days=1)) is None
+
+
+def test_albums_are_rolled_over_in_batches(app):
+    album_ids = [make_album(1, "album{}".format(index)).id for index in range(5)]
+    empty_id = make_album(0, "empty").id
+    assert roll_over(DAY, batch_size=2) == 5
+    assert all(len(picks(album_id)) == 1 for album_id in album_ids)
+    assert picks(empty_id) == []
+    assert roll_over(DAY, album_ids=album_ids[:1]) == 0
+
+
+def test_deleted_images_are_skipped(app):
+    album = make_album(3)
+    album_id = album.id
+    roll_over(DAY, rng=random.Random(1))
+    cycle = Album.query.get(album_id).get_cycle()
+    Image.query.filter(Image.id == cycle[1]).delete()
+    db.session.commit()
+
+    roll_over_days(3, rng=random.Random(1))
+    assert picks(album_id)[:2] == [cycle[0], cycle[2]]
+    assert cycle[1] not in picks(album_id)
+
+
+def test_new_images_are_spliced_in_the_running_cycle(app):
+    album = make_album(3)
+    album_id = album.id
+    roll_over(DAY, rng=random.Random(1))
+    image = Image("album/new.jpg", album_id)
+    db.session.add(image)
+    db.session.flush()
+    Album.query.get(album_id).splice_new_images(random.Random(1))
+    db.session.commit()
+
+    roll_over_days(4, rng=random.Random(1))
+    assert sorted(picks(album_id)) == sorted(
+        image.id for image in Album.query.get(album_id).images
+    )
+
+
+def test_picks_written_by_another_scheduler_are_skipped(app, monkeypatch):
+    first_id = make_album(1, "first").id
+    second_id = make_album(1, "second").id
+    plan_picks = scheduler.plan_picks
+
+    def plan_picks_racing(album_ids, rng):
+        plans = plan_picks(album_ids, rng)
+        if first_id in album_ids:
+            # Another scheduler commits the pick of the first album meanwhile
+            image_id = Album.query.get(first_id).images.first().id
+            db.session.add(DailyPick(album_id=first_id, day=DAY, image_id=image_id))
+            db.session.commit()
+        return plans
+
+    monkeypatch.setattr(scheduler, "plan_picks", plan_picks_racing)
+    assert roll_over(DAY) == 1
+    assert len(picks(first_id)) == len(picks(second_id)) == 1
+
+
+def test_run_scheduler_once(app, capsys):
+    make_album(1)
+    assert run_scheduler(once=True) == 1
+    assert "for 1 albums" in capsys.readouterr().out
+
+
+def test_rollover_moves_the_cursors_it_locked(app):
+    """A splice of new images waits for the rollover of its album to commit.
+
+    ``splice_new_images`` locks the row before rewriting the cycle, the
+    cursors must be read under the same lock and written in the same
+    transaction, or the rollover writes a position or a cycle computed
+    from the cycle before the splice.
+    """
+    album_id = make_album(3).id
+    statements = []
+
+    def before_execute(connection, clause, multiparams, params):
+        statements.append(clause)
+
+    def commit(connection):
+        statements.append("COMMIT")
+
+    engine = db.get_engine()
+    event.listen(engine, "before_execute", before_execute)
+    event.listen(engine, "commit", commit)
+    try:
+        assert roll_over(DAY, album_ids=[album_id]) == 1
+    finally:
+        event.remove(engine, "before_execute", before_execute)
+        event.remove(engine, "commit", commit)
+
+    reads = [
+        index
+        for index, statement in enumerate(statements)
+        if "cycle_position" in str(statement) and str(statement).startswith("SELECT")
+    ]
+    writes = [
+        index
+        for index, statement in enumerate(statements)
+        if str(statement).startswith("UPDATE album")
+    ]
+    assert statements[reads[0]]._for_update_arg is not None
+    assert writes and "COMMIT" not in statements[reads[0] : writes[-1]]
+    assert Album.query.get(album_id).cycle_position == 1
@@ -0,0 +1,52 @@
+import pytest
+
+from app import db
+from app.albums import find_album, new_album
+from app.models import Album
+from app.slugs import SLUG_LENGTH, decode_slug, encode_slug
+
+
+@pytest.mark.parametrize("album_id", [0, 1, 2, 61, 62, 65535, 65536, 2**32 - 1])
+def test_slugs_decode_to_their_id(app, album_id):
+    slug = encode_slug(album_id)
+    assert len(slug) == SLUG_LENGTH
+    assert decode_slug(slug) == album_id
+
+
+def test_slugs_are_distinct(app):
+    slugs = {encode_slug(album_id) for album_id in range(20000)}
+    assert len(slugs) == 20000
+    # Consecutive ids don't give away the number of albums
+    assert encode_slug(2)[:3] != encode_slug(1)[:3]
+
+
+def test_slugs_depend_on_the_key(app):
+    slug = encode_slug(1)
+    app.config["SLUG_KEY"] = "other"
+    assert encode_slug(1) != slug
+    assert decode_slug(encode_slug(1)) == 1
+
+
+def test_out_of_range_ids_are_refused(app):
+    for album_id in (-1, 2**32):
+        with pytest.raises(ValueError):
+            encode_slug(album_id)
+
+
+@pytest.mark.parametrize("slug", ["", "abc", "0a1b2c3d4e", "ab-cd_", "zzzzzz"])
+def test_other_strings_decode_to_none(app, slug):
+    assert decode_slug(slug) is None
+
+
+def test_find_album(app):
+    album = new_album("album", "alice")
+    assert album.url == encode_slug(album.id)
+    assert find_album(album.url) is album
+
+    # Albums created before the slugs keep their md5 url
+    legacy = Album("legacy", "0a1b2c3d4e", "alice")
+    db.session.add(legacy)
+    db.session.commit()
+    assert find_album("0a1b2c3d4e") is legacy
+    assert find_album(encode_slug(legacy.id)) is None
+    assert find_album("missing") is None
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import app.main.routes as routes
+import app.tokens
+from app import token_cache
+from app.main.routes import AuthError, check_permissions, requires_auth
+from app.tokens import VerifiedTokenCache
+
+
+def payload(exp, permissions=("get:albums",)):
+    return {"sub": "alice", "exp": exp, "permissions": list(permissions)}
+
+
+def test_verified_tokens_are_cached_until_exp(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.tokens.time, "time", lambda: now[0])
+    cache = VerifiedTokenCache()
+    entry = cache.put("token", payload(1060))
+    assert entry.permissions == frozenset(["get:albums"])
+    assert cache.get("token") == entry
+    assert cache.get("other") is None
+
+    now[0] = 1060
+    assert cache.get("token") is None
+    assert cache.stats() == {"size": 0, "maxsize": 1024, "hits": 1, "misses": 2}
+
+
+def test_expired_tokens_are_not_cached():
+    cache = VerifiedTokenCache()
+    entry = cache.put("token", payload(time.time() - 1))
+    assert entry.payload["sub"] == "alice"
+    assert cache.get("token") is None
+    assert VerifiedTokenCache(maxsize=0).put("token", payload(time.time() + 60))
+
+
+def test_least_recently_used_tokens_are_evicted():
+    cache = VerifiedTokenCache(maxsize=2)
+    exp = time.time() + 60
+    cache.put("first", payload(exp))
+    cache.put("second", payload(exp))
+    assert cache.get("first") is not None
+    cache.put("third", payload(exp))
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
+
+    cache.clear()
+    assert cache.stats() == {"size": 0, "maxsize": 2, "hits": 0, "misses": 0}
+
+
+def test_tokens_are_keyed_by_their_hash():
+    cache = VerifiedTokenCache()
+    cache.put(b"token", payload(time.time() + 60))
+    assert cache.get("token") is not None
+    assert b"token" not in cache._entries and "token" not in cache._entries
+
+
+def test_check_permissions():
+    assert check_permissions("get:albums", payload(0))
+    # The precomputed set of the cached token is used instead of the claim
+    assert check_permissions("get:albums", payload(0, ()), frozenset(["get:albums"]))
+    with pytest.raises(AuthError) as error:
+        check_permissions("delete:album", payload(0))
+    assert error.value.status_code == 403
+
+
+def test_check_permissions_needs_the_claim():
+    with pytest.raises(AuthError) as error:
+        check_permissions("get:albums", {"sub": "alice"})
+    assert error.value.status_code == 400
+
+
+def test_requires_auth_verifies_a_token_once(app, monkeypatch):
+    verified = []
+
+    def verify_decode_jwt(token):
+        verified.append(token)
+        return payload(time.time() + 60)
+
+    monkeypatch.setattr(routes, "verify_decode_jwt", verify_decode_jwt)
+    token_cache.clear()
+    view = requires_auth("get:albums")(lambda payload: payload["sub"])
+    with app.test_request_context("/"):
+        from flask import session
+
+        session["jwt_payload"] = {"access_token": "token"}
+        assert view() == "alice"
+        assert view() == "alice"
+    assert verified == ["token"]
+    assert token_cache.stats()["hits"] == 1
+    token_cache.clear()
@@ -0,0 +1,161 @@
+import io
+import threading
+
+import pytest
+from PIL import Image as PILImage
+from werkzeug.datastructures import FileStorage
+
+from app import jobs, storage
+from app.models import Album, Blob, Image
+from app.uploads import CACHE_CONTROL, upload_files
+
+
+class FakeS3Client(object):
+    """The part of a boto3 S3 client used by the uploads, kept in memory.
+
+    Uploads of keys ending with one of ``failing`` raise. With ``barrier``
+    every upload waits for the others, to check they run concurrently.
+    """
+
+    def __init__(self, failing=(), barrier=None):
+        self.objects = {}
+        self.uploads = []
+        self.deleted = []
+        self.failing = failing
+        self.barrier = barrier
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        if self.barrier is not None:
+            self.barrier.wait(5)
+        body = fileobj.read()
+        with self._lock:
+            self.uploads.append((bucket, key, ExtraArgs, Config))
+        if key.endswith(tuple(self.failing)):
+            raise OSError("upload of {} failed".format(key))
+        with self._lock:
+            self.objects[key] = body
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.deleted.append(obj["Key"])
+                self.objects.pop(obj["Key"], None)
+        return {}
+
+
+def files(count):
+    return [
+        FileStorage(
+            io.BytesIO(b"photo %d" % index),
+            "photo{}.JPG".format(index),
+            content_type="image/jpeg",
+        )
+        for index in range(count)
+    ]
+
+
+def test_files_are_uploaded_concurrently():
+    client = FakeS3Client(barrier=threading.Barrier(4))
+    results = []
+    uploaded = upload_files(
+        client,
+        "bucket",
+        files(4),
+        key_prefix="albums/a/",
+        max_workers=4,
+        multipart_threshold=1024,
+        acl="private",
+        on_result=results.append,
+    )
+    assert [result.filename for result in uploaded] == [
+        "photo{}.JPG".format(index) for index in range(4)
+    ]
+    assert all(result.error is None for result in uploaded)
+    assert sorted(results) == sorted(uploaded)
+    for result in uploaded:
+        assert result.key.startswith("albums/a/") and result.key.endswith(".jpg")
+    assert {client.objects[result.key] for result in uploaded} == {
+        b"photo %d" % index for index in range(4)
+    }
+    for bucket, key, extra_args, config in client.uploads:
+        assert bucket == "bucket"
+        assert extra_args == {
+            "ContentType": "image/jpeg",
+            "CacheControl": CACHE_CONTROL,
+            "ACL": "private",
+        }
+        assert config.multipart_threshold == 1024
+
+
+def test_failed_uploads_are_reported_per_file():
+    client = FakeS3Client(failing=["1.jpg"])
+    uploaded = upload_files(
+        client, "bucket", files(3), keys=["0.jpg", "1.jpg", "2.jpg"], max_workers=2
+    )
+    assert [result.key for result in uploaded] == ["0.jpg", "1.jpg", "2.jpg"]
+    assert [result.error is None for result in uploaded] == [True, False, True]
+    assert sorted(client.objects) == ["0.jpg", "2.jpg"]
+    assert "ACL" not in client.uploads[0][2]
+
+
+@pytest.fixture
+def config(config, monkeypatch):
+    # Keeps botocore from looking for credentials on the network
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+
+    class S3Config(config):
+        STORAGE_TYPE = "s3"
+        S3_BUCKET = "bucket"
+        S3_UPLOAD_WORKERS = 4
+
+    return S3Config
+
+
+def photo(color):
+    stream = io.BytesIO()
+    PILImage.new("RGB", (600, 400), color).save(stream, "PNG")
+    stream.seek(0)
+    return stream
+
+
+def ingest(app, client, name, colors):
+    storage.backend.client = client
+    app.test_client().post(
+        "/create",
+        data={
+            "name": name,
+            "photo": [
+                (photo(color), "{}.png".format(index))
+                for index, color in enumerate(colors)
+            ],
+        },
+        content_type="multipart/form-data",
+    )
+    return jobs.run_one(timeout=0)
+
+
+def test_albums_are_ingested_to_s3(app):
+    client = FakeS3Client()
+    job = ingest(app, client, "album", [(200, 0, 0), (0, 0, 200)])
+    assert job["state"] == "done", job["error"]
+
+    album = Album.query.filter(Album.name == "album").one()
+    stored = {key for blob in Blob.query for key in blob.keys()}
+    assert album.images.count() == 2
+    assert stored == set(client.objects)
+    assert {image.key for image in album.images} <= stored
+
+
+def test_failed_ingestion_deletes_what_it_uploaded(app):
+    client = FakeS3Client(failing=["_thumb.jpg"])
+    job = ingest(app, client, "album", [(200, 0, 0), (0, 0, 200)])
+    assert job["state"] == "failed"
+
+    uploaded = {key for _, key, _, _ in client.uploads}
+    assert client.objects == {}
+    assert set(client.deleted) == {
+        key for key in uploaded if not key.endswith("_thumb.jpg")
+    }
+    assert Album.query.count() == Image.query.count() == Blob.query.count() == 0